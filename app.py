@@ -1,8 +1,18 @@
 import os
-from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, session
+from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, session, g, Response, stream_with_context
 from flask_cors import CORS
 from authlib.integrations.flask_client import OAuth
-from chat_backend import RiquerChatBot
+from tenants import TenantRegistry
+from shared_state import get_state_store, ANSWER_CACHE_PREFIX
+from oidc_cache import OIDCCache, LoginTimer, login_latency_report
+from generation_profiles import profile_report
+from tracing import start_span, end_span, install_log_correlation, ring_buffer, wrap_context
+from deadlines import DeadlineExceeded, deadline_scope, overrun_report
+from memory_budget import MemoryBudget
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import re
+import json
+import time
 import logging
 from functools import wraps
 import secrets
@@ -17,8 +27,8 @@ app = Flask(__name__,
 CORS(app)
 
 
-# Añade esto al inicio de tu app.py
-request_count = {}
+# Comptador de peticions per ruta, compartit entre workers
+state_store = get_state_store()
 
 @app.before_request
 def log_request():
@@ -26,19 +36,41 @@ def log_request():
     now = datetime.datetime.now()
     path = request.path
     
-    if path not in request_count:
-        request_count[path] = 0
-    request_count[path] += 1
+    total = state_store.incr(f"path:{path}")
     
-    print(f"🌐 [{now}] {request.method} {path} - Total: {request_count[path]}")
+    print(f"🌐 [{now}] {request.method} {path} - Total: {total}")
 
 # Configurar clau secreta
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 
-# Configurar logging
+# Configurar logging (amb el trace_id de la petició a cada línia)
 logging.basicConfig(level=logging.INFO)
+install_log_correlation()
 logger = logging.getLogger(__name__)
 
+# Span arrel per petició; es pot continuar una traça amb la capçalera X-Trace-Id
+@app.before_request
+def start_request_trace():
+    incoming = request.headers.get('X-Trace-Id', '')
+    trace_id = incoming if re.fullmatch(r'[0-9a-f]{16,32}', incoming) else None
+    g.trace_span, g.trace_token = start_span(
+        f"{request.method} {request.path}", trace_id=trace_id, endpoint=request.endpoint
+    )
+
+@app.after_request
+def add_trace_header(response):
+    trace_span = g.get('trace_span')
+    if trace_span:
+        trace_span.set_attribute('status_code', response.status_code)
+        response.headers['X-Trace-Id'] = trace_span.trace_id
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    trace_span = g.pop('trace_span', None)
+    if trace_span:
+        end_span(trace_span, g.pop('trace_token', None), error)
+
 # Verificar configuració OAuth
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
@@ -59,33 +91,91 @@ def get_base_url():
     # Para desarrollo local
     return f"http://localhost:{os.environ.get('PORT', 5000)}"
 
+# Cache a disc del document de descoberta i les claus (JWKS) de Google
+oidc = OIDCCache(
+    metadata_ttl=float(os.environ.get('OIDC_METADATA_TTL', 86400)),
+    jwks_ttl=float(os.environ.get('OIDC_JWKS_TTL', 3600))
+)
+
+def get_oidc_metadata():
+    """Metadades OIDC des de la cache; {} si no hi ha ni còpia ni xarxa"""
+    try:
+        return oidc.authlib_metadata()
+    except Exception as e:
+        logger.error(f"Error carregant metadades OIDC: {str(e)}")
+        return {}
+
 # Registrar Google OAuth
 try:
+    oidc_metadata = get_oidc_metadata()
+    if oidc_metadata:
+        # Amb les metadades de la cache authlib no fa la descoberta per xarxa
+        oauth_endpoints = oidc_metadata
+    else:
+        oauth_endpoints = {
+            'access_token_url': 'https://oauth2.googleapis.com/token',
+            'authorize_url': 'https://accounts.google.com/o/oauth2/auth',
+            'server_metadata_url': 'https://accounts.google.com/.well-known/openid-configuration',
+        }
+    
     google = oauth.register(
         name='google',
         client_id=GOOGLE_CLIENT_ID,
         client_secret=GOOGLE_CLIENT_SECRET,
-        access_token_url='https://oauth2.googleapis.com/token',
-        authorize_url='https://accounts.google.com/o/oauth2/auth',
         api_base_url='https://www.googleapis.com/oauth2/v1/',
-        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
         client_kwargs={
             'scope': 'openid email profile',
             'prompt': 'select_account'
-        }
+        },
+        **oauth_endpoints
     )
     logger.info("Google OAuth registrado correctamente")
 except Exception as e:
     logger.error(f"Error registrando OAuth: {str(e)}")
     google = None
 
-# Inicializar el bot
-try:
-    bot = RiquerChatBot()
-    logger.info("Bot inicializado correctamente")
-except Exception as e:
-    logger.error(f"Error inicializando bot: {str(e)}")
-    bot = None
+# Registre d'instituts: cada bot es carrega sota demanda segons el host
+tenants = TenantRegistry.from_env()
+
+def get_bot():
+    """Bot de l'institut corresponent al host de la petició"""
+    try:
+        return tenants.get_for_host(request.host)
+    except Exception as e:
+        logger.error(f"Error inicializando bot: {str(e)}")
+        return None
+
+# Pressupost de memòria: caches primer, després compactar i descartar converses antigues
+CONVERSATION_COMPACT_MESSAGES = int(os.environ.get('CONVERSATION_COMPACT_MESSAGES', 4))
+memory_budget = MemoryBudget.from_env(store=state_store)
+
+memory_budget.track('corpus', lambda: sum(bot.corpus.nbytes for bot in tenants.loaded_bots() if bot.corpus))
+memory_budget.track('extractive_index', lambda: sum(bot.cache_bytes() for bot in tenants.loaded_bots()))
+memory_budget.track('answer_cache', lambda: state_store.cache_bytes(ANSWER_CACHE_PREFIX))
+memory_budget.track('trace_buffer', ring_buffer.nbytes)
+memory_budget.track('oidc', oidc.nbytes)
+memory_budget.track('conversations', lambda: (
+    sum(state_store.session_sizes().values()) + sum(bot.history_bytes() for bot in tenants.loaded_bots())
+))
+
+memory_budget.shed_with('answer_cache', 'answer_cache',
+                        lambda: state_store.cache_clear(ANSWER_CACHE_PREFIX), priority=0)
+memory_budget.shed_with('extractive_index', 'extractive_index',
+                        lambda: [bot.drop_caches() for bot in tenants.loaded_bots()], priority=1)
+memory_budget.shed_with('trace_buffer', 'trace_buffer', ring_buffer.clear, priority=2)
+memory_budget.shed_with('oidc', 'oidc', oidc.clear_memory, priority=3)
+memory_budget.shed_with('compact_conversations', 'conversations', lambda: (
+    state_store.compact_sessions(CONVERSATION_COMPACT_MESSAGES),
+    [bot.compact_history(CONVERSATION_COMPACT_MESSAGES) for bot in tenants.loaded_bots()]
+), priority=10)
+memory_budget.shed_with('drop_conversations', 'conversations', lambda: (
+    state_store.drop_oldest_sessions(0.5),
+    [bot.compact_history(0) for bot in tenants.loaded_bots()]
+), priority=20)
+
+@app.before_request
+def check_memory_budget():
+    memory_budget.maybe_check()
 
 # Decorador para requerir login
 def login_required(f):
@@ -96,6 +186,24 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Correus amb accés a les rutes d'administració (separats per comes)
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.environ.get('ADMIN_EMAILS', '').split(',')
+    if email.strip()
+}
+
+# Decorador para requerir permisos de administrador
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user' not in session:
+            return redirect(url_for('login'))
+        if session['user'].get('email', '').lower() not in ADMIN_EMAILS:
+            return jsonify({'status': 'error', 'error': 'Accés restringit'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Ruta de login
 @app.route('/login')
 def login():
@@ -248,7 +356,12 @@ def google_auth():
         logger.info(f"OAuth Request - Base URL: {base_url}")
         logger.info(f"Redirect URI: {redirect_uri}")
         
-        return google.authorize_redirect(redirect_uri)
+        timer = LoginTimer(state_store)
+        with timer.step('authorize_redirect'):
+            response = google.authorize_redirect(redirect_uri)
+        timer.finish()
+        
+        return response
     except Exception as e:
         logger.error(f"Error iniciando OAuth: {str(e)}")
         return redirect(url_for('login', error='oauth_init_error', error_description=str(e)))
@@ -259,12 +372,31 @@ def google_callback():
         return redirect(url_for('login', error='oauth_not_configured'))
     
     try:
-        token = google.authorize_access_token()
+        timer = LoginTimer(state_store)
+        
+        # Mantenir les claus d'authlib al dia amb la cache (rotació de claus)
+        with timer.step('metadata'):
+            google.server_metadata.update(get_oidc_metadata())
+        
+        # Intercanvi del codi; authlib verifica l'ID token amb el JWKS de la cache
+        with timer.step('token_exchange'):
+            token = google.authorize_access_token()
         user_info = token.get('userinfo')
         
+        # Sense userinfo: claims de l'ID token verificat localment, sense crida extra
+        if not user_info and token.get('id_token'):
+            with timer.step('id_token_verify'):
+                try:
+                    user_info = oidc.verify_id_token(token['id_token'], GOOGLE_CLIENT_ID)
+                except Exception as e:
+                    logger.warning(f"No s'ha pogut verificar l'ID token localment: {str(e)}")
+        
         if not user_info:
-            resp = google.get('userinfo')
-            user_info = resp.json()
+            with timer.step('userinfo_fetch'):
+                resp = google.get('userinfo')
+                user_info = resp.json()
+        
+        timer.finish()
         
         if user_info:
             email = user_info.get('email', '')
@@ -289,6 +421,9 @@ def google_callback():
 # Ruta de logout
 @app.route('/logout')
 def logout():
+    email = session.get('user', {}).get('email')
+    if email:
+        state_store.delete_session(f"{tenants.resolve(request.host)}:{email}")
     session.clear()
     return redirect(url_for('login'))
 
@@ -298,10 +433,26 @@ def logout():
 def index():
     return render_template('index.html', user=session['user'])
 
+# Termini per petició (segons); el client pot demanar-ne un de més curt amb X-Request-Budget-Ms,
+# però mai per sota de REQUEST_MIN_DEADLINE
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 25))
+REQUEST_MIN_DEADLINE = min(float(os.environ.get('REQUEST_MIN_DEADLINE', 5)), REQUEST_DEADLINE)
+BATCH_QUESTION_DEADLINE = float(os.environ.get('BATCH_QUESTION_DEADLINE', REQUEST_DEADLINE))
+
+def request_budget() -> float:
+    try:
+        requested = float(request.headers.get('X-Request-Budget-Ms', 0)) / 1000
+    except ValueError:
+        requested = 0
+    if not requested > 0:
+        return REQUEST_DEADLINE
+    return max(REQUEST_MIN_DEADLINE, min(requested, REQUEST_DEADLINE))
+
 # API endpoint para el chat
 @app.route('/api/chat', methods=['POST'])
 @login_required
 def chat():
+    bot = get_bot()
     if not bot:
         return jsonify({
             'status': 'error',
@@ -313,12 +464,31 @@ def chat():
         message = data.get('message', '')
         
         user = session.get('user', {})
+        
+        # Límit de peticions per usuari (el personal del centre té més marge)
+        retry_after = tenants.shared.scheduler.check_rate(user.get('email', ''))
+        if retry_after is not None:
+            response = jsonify({
+                'status': 'error',
+                'message': f"Has fet moltes consultes seguides. Torna-ho a provar d'aquí a {int(retry_after) + 1} segons. 🙏",
+                'retry_after': round(retry_after, 1)
+            })
+            response.headers['Retry-After'] = str(int(retry_after) + 1)
+            return response, 429
+        
         user_data = {
             'nom': user.get('name', 'Usuari'),
-            'contacte': user.get('email', '')
+            'contacte': user.get('email', ''),
+            'session_id': user.get('email', '')
         }
         
-        response = bot.process_message(message, user_data)
+        # Clau d'idempotència dels formularis (generada pel client per a cada enviament)
+        idempotency_key = request.headers.get('Idempotency-Key', '')
+        if re.fullmatch(r'[A-Za-z0-9-]{8,64}', idempotency_key):
+            user_data['idempotency_key'] = idempotency_key
+        
+        with deadline_scope(request_budget()):
+            response = bot.process_message(message, user_data)
         
         return jsonify({
             'status': 'success',
@@ -326,6 +496,13 @@ def chat():
             'timestamp': data.get('timestamp', '')
         })
         
+    except DeadlineExceeded as e:
+        logger.warning(f"Termini esgotat en /api/chat: {e.stage}")
+        return jsonify({
+            'status': 'error',
+            'message': "La consulta està trigant massa. Si us plau, torna-ho a provar d'aquí a uns segons. 🙏",
+            'stage': e.stage
+        }), 504
     except Exception as e:
         logger.error(f"Error en /api/chat: {str(e)}")
         return jsonify({
@@ -334,10 +511,102 @@ def chat():
             'error': str(e)
         }), 500
 
+# Pool limitat per a les preguntes en lot (compartit per totes les peticions)
+BATCH_MAX_QUESTIONS = int(os.environ.get('BATCH_MAX_QUESTIONS', 50))
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('BATCH_WORKERS', 4)),
+    thread_name_prefix='batch'
+)
+
+# API endpoint per a preguntes en lot (personal del centre); respon en NDJSON
+@app.route('/api/chat/batch', methods=['POST'])
+@login_required
+def chat_batch():
+    bot = get_bot()
+    if not bot:
+        return jsonify({
+            'status': 'error',
+            'message': 'Bot no inicializado'
+        }), 500
+    
+    user = session.get('user', {})
+    email = user.get('email', '').lower()
+    if email.rsplit('@', 1)[-1] != bot.tenant.email_domain.lower() and email not in ADMIN_EMAILS:
+        return jsonify({'status': 'error', 'error': 'Accés restringit al personal del centre'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) for q in questions):
+        return jsonify({'status': 'error', 'error': "Cal una llista 'questions' de textos"}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({'status': 'error', 'error': f'Màxim {BATCH_MAX_QUESTIONS} preguntes per lot'}), 400
+    
+    # Un testimoni per pregunta: les que superen el límit de l'usuari no s'envien
+    allowed = []
+    retry_after = None
+    for index in range(len(questions)):
+        retry_after = tenants.shared.scheduler.check_rate(email)
+        if retry_after is not None:
+            break
+        allowed.append(index)
+    throttled = range(len(allowed), len(questions))
+    
+    if not allowed:
+        response = jsonify({'status': 'error', 'error': 'Massa peticions', 'retry_after': round(retry_after, 1)})
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+        return response, 429
+    
+    # Sense sessió: cada pregunta és independent; les crides al model passen pel planificador
+    user_data = {
+        'nom': user.get('name', 'Usuari'),
+        'contacte': email,
+        'stateless': True
+    }
+    
+    def answer(index, question):
+        start = time.perf_counter()
+        with deadline_scope(BATCH_QUESTION_DEADLINE):
+            text = bot.process_message(question, user_data)
+        return {
+            'index': index,
+            'question': question,
+            'response': text,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000)
+        }
+    
+    def generate():
+        futures = [
+            batch_executor.submit(wrap_context(answer), index, questions[index])
+            for index in allowed
+        ]
+        try:
+            for index in throttled:
+                yield json.dumps({
+                    'index': index,
+                    'status': 'throttled',
+                    'retry_after': round(retry_after, 1)
+                }, ensure_ascii=False) + '\n'
+            for future in as_completed(futures):
+                try:
+                    result = dict(future.result(), status='success')
+                except DeadlineExceeded as e:
+                    result = {'index': futures.index(future), 'status': 'timeout', 'error': str(e)}
+                except Exception as e:
+                    logger.error(f"Error en /api/chat/batch: {str(e)}")
+                    result = {'index': futures.index(future), 'status': 'error', 'error': str(e)}
+                yield json.dumps(result, ensure_ascii=False) + '\n'
+        finally:
+            # Si el client es desconnecta, no cal respondre la resta
+            for future in futures:
+                future.cancel()
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # API endpoint para obtener lista de profesores
 @app.route('/api/teachers')
 @login_required
 def get_teachers():
+    bot = get_bot()
     if not bot:
         return jsonify({
             'status': 'error',
@@ -348,7 +617,8 @@ def get_teachers():
         teachers = bot.get_teachers_list()
         return jsonify({
             'status': 'success',
-            'teachers': teachers
+            'teachers': teachers,
+            'email_domain': bot.tenant.email_domain
         })
     except Exception as e:
         logger.error(f"Error obtenint professors: {str(e)}")
@@ -368,6 +638,15 @@ def get_user():
 def send_static(path):
     return send_from_directory('static', path)
 
+# Service worker servit des de l'arrel perquè el seu abast sigui tot el lloc
+@app.route('/sw.js')
+def service_worker():
+    response = send_from_directory('static/js', 'sw.js')
+    response.headers['Content-Type'] = 'application/javascript'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Service-Worker-Allowed'] = '/'
+    return response
+
 # Health check
 @app.route('/api/health')
 def health():
@@ -376,7 +655,82 @@ def health():
         'service': 'Riquer Chat Bot',
         'environment': 'Railway',
         'oauth_configured': bool(GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET),
-        'bot_initialized': bot is not None
+        'tenants': tenants.get_status()
+    })
+
+# Estadístiques dels nivells de model (latència, hedging, circuit breaker)
+@app.route('/api/admin/models')
+@admin_required
+def admin_models():
+    router = tenants.shared.router
+    if not router:
+        return jsonify({'status': 'error', 'error': 'Bot no inicializado'}), 500
+    
+    return jsonify({
+        'status': 'success',
+        'tiers': router.get_stats(),
+        'profiles': profile_report(state_store)
+    })
+
+# Traces recents (buffer circular en memòria d'aquest worker)
+@app.route('/api/admin/traces')
+@admin_required
+def admin_traces():
+    trace_id = request.args.get('trace_id')
+    if trace_id:
+        return jsonify({'status': 'success', 'spans': ring_buffer.get_spans(trace_id)})
+    
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({'status': 'success', 'traces': ring_buffer.get_traces(limit)})
+
+# Peticions que han esgotat el termini, per etapa (gemini, fair_share, retry.backoff, mailgun)
+@app.route('/api/admin/deadlines')
+@admin_required
+def admin_deadlines():
+    return jsonify({
+        'status': 'success',
+        'request_deadline': REQUEST_DEADLINE,
+        'request_min_deadline': REQUEST_MIN_DEADLINE,
+        'batch_question_deadline': BATCH_QUESTION_DEADLINE,
+        'overruns': overrun_report(state_store)
+    })
+
+# Latència mitjana de cada pas del login
+@app.route('/api/admin/login-latency')
+@admin_required
+def admin_login_latency():
+    return jsonify({
+        'status': 'success',
+        'steps': login_latency_report(state_store)
+    })
+
+# Comptadors d'ús per usuari i estat de la cua de crides al model
+@app.route('/api/admin/usage')
+@admin_required
+def admin_usage():
+    scheduler = tenants.shared.scheduler
+    return jsonify({
+        'status': 'success',
+        'scheduler': scheduler.get_status(),
+        'usage': scheduler.get_usage()
+    })
+
+# Informe de memoria per component (corpus, historial) i pressupost del procés (?tracemalloc=N)
+@app.route('/api/admin/memory')
+@admin_required
+def admin_memory():
+    bot = get_bot()
+    if not bot:
+        return jsonify({'status': 'error', 'error': 'Bot no inicializado'}), 500
+    
+    return jsonify({
+        'status': 'success',
+        'tenant': bot.tenant.id,
+        'memory': bot.get_memory_report(),
+        'budget': memory_budget.report(request.args.get('tracemalloc', 0, type=int)),
+        'largest_conversations': dict(
+            sorted(state_store.session_sizes().items(), key=lambda item: item[1], reverse=True)[:20]
+        )
     })
 
 # Error handlers
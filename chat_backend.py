@@ -23,6 +23,19 @@ import time
 from functools import wraps
 import unicodedata
 import unicodedata
+from model_router import GeminiClient, RouterChat, DEFAULT_SAFETY_SETTINGS, is_quota_error, output_tokens
+from tenants import TenantConfig, SharedResources
+from fair_share import FairShareTimeout
+from corpus import Corpus, memory_report, approx_bytes
+from shared_state import get_state_store, ANSWER_CACHE_PREFIX
+from text_utils import normalize_question
+from tracing import span, traced
+from extractive import ExtractiveAnswerer
+from generation_profiles import PROFILES, classify_intent, record_generation
+from idempotency import FormDeduplicator
+from corpus_minify import decode, minify_document
+import deadlines
+from deadlines import DeadlineExceeded
 
 # Configuració de logging
 logging.basicConfig(level=logging.INFO)
@@ -68,6 +81,9 @@ if not api_key:
 
 genai.configure(api_key=api_key)
 
+# Resposta quan el model o la cua de crides estan saturats
+SATURATED_MESSAGE = "Ho sento molt, el sistema està temporalment saturat degut a l'alta demanda. Si us plau, espera uns segons i torna-ho a intentar. 🙏"
+
 # Decorador per gestionar límits de peticions amb retry
 def retry_with_exponential_backoff(
     max_retries=3,
@@ -83,22 +99,29 @@ def retry_with_exponential_backoff(
             
             for attempt in range(max_retries + 1):
                 try:
-                    return func(*args, **kwargs)
+                    with span(f"{func.__name__}.attempt", attempt=attempt + 1):
+                        return func(*args, **kwargs)
+                except DeadlineExceeded:
+                    raise
                 except Exception as e:
-                    error_str = str(e).lower()
-                    
                     # Detectar error 429 o límit de quota
-                    if any(keyword in error_str for keyword in ["429", "resource exhausted", "quota", "rate limit"]):
+                    if is_quota_error(e):
                         if attempt < max_retries:
                             wait_time = delay + (attempt * 0.5)  # Afegir jitter
+                            # Si l'espera no cap dins del termini de la petició, no es reintenta
+                            left = deadlines.remaining()
+                            if left is not None and left <= wait_time:
+                                deadlines.record_overrun('retry.backoff')
+                                raise DeadlineExceeded('retry.backoff')
                             logger.warning(f"⚠️ Límit de peticions assolit. Reintent {attempt + 1}/{max_retries} després de {wait_time:.1f}s")
-                            time.sleep(wait_time)
+                            with span("retry.backoff", seconds=wait_time):
+                                time.sleep(wait_time)
                             delay = min(delay * exponential_base, max_delay)
                             continue
                         else:
                             logger.error(f"❌ Màxim de reintents assolit després de {max_retries} intents")
                             # Retornar missatge amigable
-                            return "Ho sento molt, el sistema està temporalment saturat degut a l'alta demanda. Si us plau, espera uns segons i torna-ho a intentar. 🙏"
+                            return SATURATED_MESSAGE
                     else:
                         # Si no és error 429, llançar immediatament
                         logger.error(f"Error inesperat: {e}")
@@ -110,11 +133,24 @@ def retry_with_exponential_backoff(
 
 
 class RiquerChatBot:
-    def __init__(self):
+    def __init__(self, client=None, tenant: Optional[TenantConfig] = None,
+                 shared: Optional[SharedResources] = None, store=None):
+        self.tenant = tenant or TenantConfig.default()  # Institut servit per aquesta instància
+        self.shared = shared or SharedResources(client=client)  # Client, router i pool HTTP comuns
+        self.shared.scheduler.staff_domains.add(self.tenant.email_domain.lower())  # Més pes per al personal
         self.model = None
+        self.router = None
         self.chat = None
-        self.file_contents = []  # Contingut dels arxius com a text
-        self.request_count = 0  # Comptador de peticions
+        self.corpus = None  # Contingut dels arxius (UTF-8 mapat a drive_files/)
+        self.store = store or get_state_store()  # Sessions, caches i comptadors compartits entre workers
+        self.answer_cache_ttl = float(os.environ.get('ANSWER_CACHE_TTL', 3600))
+        self.degraded_mode = os.environ.get('DEGRADED_MODE', 'auto').lower()  # auto | on | off
+        self.degraded_latency = float(os.environ.get('DEGRADED_LATENCY_THRESHOLD', 10))
+        self._extractive = None  # Índex extractiu local, construït sota demanda
+        self.minify_corpus = os.environ.get('CORPUS_MINIFY', 'on').lower() != 'off'
+        self.corpus_report = {}  # Tokens estimats abans/després per arxiu
+        self.use_profiles = os.environ.get('GENERATION_PROFILES', 'on').lower() != 'off'
+        self.forms = FormDeduplicator.from_env(self.store)  # Evita correus duplicats per dobles enviaments
         self.initialize_directories()
         self.initialize_files()
         self.initialize_chat()
@@ -126,20 +162,17 @@ class RiquerChatBot:
     
     def initialize_files(self):
         """Descarga els arxius CSV/TXT i els guarda com a text"""
-        file_urls = [
-            "https://drive.google.com/uc?export=download&id=1bL1CnwVTpKS_01AKDV1i7Uu90pImQQe1",
-            "https://drive.google.com/uc?export=download&id=1kOjm0jHpF-LqtXYC7uUC1HJAV7DQPBsy",
-            "https://drive.google.com/uc?export=download&id=1iMfgjXLrn51EkYhCqMejJT7K5M5J5Ezy",
-            "https://drive.google.com/uc?export=download&id=1N7Xpt9JSr1JPoIaju-ekIRW4NGVgPxMU",
-            "https://drive.google.com/uc?export=download&id=1neJFgTH0GWO5HbL64V6Fro0r1SKw8mFw",
-        ]
+        file_urls = self.tenant.file_urls
         
+        documents = []
         successful_downloads = 0
+        self.corpus_report = {}
         
         for i, url in enumerate(file_urls):
             try:
                 logger.info(f"Descargando archivo {i+1} de {len(file_urls)}")
-                response = requests.get(url, timeout=30)
+                with span("drive.fetch", file=i + 1, url=url):
+                    response = self.shared.http.get(url, timeout=30)
                 response.raise_for_status()
                 
                 # Verificar si es una página HTML de error
@@ -152,17 +185,19 @@ class RiquerChatBot:
                     logger.warning(f"Archivo {i+1}: Tamaño muy pequeño ({len(response.content)} bytes)")
                     continue
                 
-                # Intentar decodificar el contenido
-                try:
-                    content = response.content.decode('utf-8')
-                except UnicodeDecodeError:
-                    try:
-                        content = response.content.decode('latin-1')
-                    except:
-                        content = response.content.decode('utf-8', errors='ignore')
+                # Decodificar i minimitzar (taules compactes, sense HTML ni espais sobrers)
+                if self.minify_corpus:
+                    content, report = minify_document(response.content)
+                    logger.info(
+                        f"✂️ Archivo {i+1}: ~{report['tokens_before']} -> ~{report['tokens_after']} tokens "
+                        f"({report['saved_pct']}% menys, {report['kind']})"
+                    )
+                    self.corpus_report[f"Archivo {i+1}"] = report
+                else:
+                    content = decode(response.content)
                 
                 # Guardar contenido
-                self.file_contents.append(f"\n--- Archivo {i+1} ---\n{content}")
+                documents.append((f"Archivo {i+1}", f"\n--- Archivo {i+1} ---\n{content}"))
                 successful_downloads += 1
                 logger.info(f"Archivo {i+1} cargado correctamente")
                 
@@ -170,19 +205,18 @@ class RiquerChatBot:
                 logger.error(f"Error cargando archivo {url}: {str(e)}")
                 continue
         
+        # Una sola còpia compacta del corpus per a tots els consumidors
+        self.corpus = Corpus.build(os.path.join('drive_files', f'{self.tenant.id}.corpus'), documents)
+        
         logger.info(f"Archivos cargados exitosamente: {successful_downloads}/{len(file_urls)}")
     
     def get_teachers_list(self) -> List[Dict]:
         """Obtiene la lista de profesores para el formulario"""
-        teachers = [
-            {'name': 'Jordi Pipó', 'email': 'jordi.pipo@inscalaf.cat'},
-            {'name': 'Anna Bresolí', 'email': 'anna.bresoli@inscalaf.cat'},
-            {'name': 'Gerard Corominas', 'email': 'gerard.corominas@inscalaf.cat'},
-            {'name': 'Roger Codina', 'email': 'roger.codina@inscalaf.cat'}
-        ]
+        teachers = self.tenant.teachers
         
         return teachers
     
+    @traced("mailgun.send_email")
     def send_email(self, subject: str, body: str, recipients: List[str]) -> Dict:
         """Envía emails via Mailgun API"""
         try:
@@ -197,18 +231,18 @@ class RiquerChatBot:
                 }
             
             data = {
-                'from': 'Institut Alexandre de Riquer <riquer@inscalaf.cat>',
+                'from': f'{self.tenant.name} <{self.tenant.sender}>',
                 'to': recipients,
                 'subject': subject,
                 'text': body
             }
             
             # Enviar via Mailgun API
-            response = requests.post(
+            response = self.shared.http.post(
                 f"https://api.mailgun.net/v3/{mailgun_domain}/messages",
                 auth=("api", mailgun_api_key),
                 data=data,
-                timeout=15
+                timeout=deadlines.bounded_timeout('mailgun', 15)
             )
             
             if response.status_code == 200:
@@ -217,7 +251,7 @@ class RiquerChatBot:
                     "status": "success",
                     "subject": subject,
                     "body": body,
-                    "sender": "riquer@inscalaf.cat",
+                    "sender": self.tenant.sender,
                     "recipients": recipients,
                 }
             else:
@@ -227,7 +261,13 @@ class RiquerChatBot:
                     "error": f"Error enviant email: {response.status_code}"
                 }
                 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
+            if deadlines.caused_by_deadline(e):
+                # Sense temps per a Mailgun: la vista respon 504 en lloc d'un error d'enviament
+                deadlines.record_overrun('mailgun')
+                raise DeadlineExceeded('mailgun') from e
             logger.error(f"Error enviando correo: {str(e)}")
             return {
                 "status": "error",
@@ -237,7 +277,7 @@ class RiquerChatBot:
     def initialize_chat(self):
         """Inicializa el chat con Gemini"""
         try:
-            # Crear model amb configuració de seguretat relaxada
+            # Crear client amb configuració de seguretat relaxada
             generation_config = {
                 "temperature": 0.7,
                 "top_p": 0.95,
@@ -245,95 +285,129 @@ class RiquerChatBot:
                 "max_output_tokens": 1024,
             }
             
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-            ]
-            
-            self.model = genai.GenerativeModel(
-                'gemini-2.5-flash-lite',
-                generation_config=generation_config,
-                safety_settings=safety_settings
+            # Client i política de models per nivells (hedging, fallback i circuit breaker),
+            # compartits entre tots els instituts del procés
+            self.model, self.router = self.shared.get_model_client(
+                lambda: GeminiClient(generation_config, DEFAULT_SAFETY_SETTINGS)
             )
             
-            # Contexto del sistema en catalán con los archivos como texto
-            context = f"""Ets Riquer, assistent virtual de l'Institut Alexandre de Riquer de Calaf.
-            
-            PERSONALITAT: Amable, proper, eficient. SEMPRE en CATALÀ.
-            
-            FUNCIONS:
-            - Informar sobre l'institut (horaris, cursos, contactes)
-            - Ajudar a contactar professors → suggereix botó "Sol·licitar reunió"
-            - Justificar faltes → suggereix botó "Justificar falta"
-            - Resoldre dubtes acadèmics i administratius
-            
-            CONTACTE:
-            📍 C. Sant Joan Bta. de la Salle 6-8, 08280 Calaf
-            📞 93 868 04 14
-            📧 a8043395@xtec.cat
-            📧 abdellahbaghalbachiri@gmail.com (consergeria)
-            🌐 inscalaf.cat
-            
-            HORARIS:
-            🏫 Classes: 8:00-14:35h
-            🏢 Atenció: dilluns-divendres 8:00-14:00h
-            📋 Secretaria: dilluns-divendres 9:00-13:00h
-            
-            CURSOS: ESO (1r-4t), Batxillerat (1r-2n), FP (GM i GS)
-            
-            REGLES:
-            ✓ Respostes breus i clares
-            ✓ Només info verificada dels arxius
-            ✓ Si no saps algo → indica-ho clarament
-            ✓ Emojis moderats (màx 2 per resposta)
-            ✗ NO inventis informació
-            ✗ NO temes aliens a l'institut
-            
-            INFORMACIÓ DELS ARXIUS DE L'INSTITUT:
-            {"".join(self.file_contents) if self.file_contents else "No s'han pogut carregar els arxius"}
-            
-            Respon SEMPRE en CATALÀ. Sigues útil i directe."""
-            
-            # Iniciar chat
-            self.chat = self.model.start_chat(
-                history=[
-                    {
-                        "role": "user", 
-                        "parts": [context]
-                    },
-                    {
-                        "role": "model", 
-                        "parts": ["Entès! Sóc Riquer, l'assistent virtual de l'Institut Alexandre de Riquer. "
-                                 "He processat tota la informació de l'institut. "
-                                 "Puc ajudar-te amb qualsevol consulta sobre l'institut. "
-                                 "En què et puc ajudar avui?"]
-                    }
-                ]
-            )
+            # Iniciar chat; el context amb els arxius es construeix a cada crida
+            self.chat = RouterChat(self.router, [], preamble=self._build_preamble, store=self.store)
             
-            logger.info(f"✅ Chat inicializado con {len(self.file_contents)} archivos cargados")
+            logger.info(f"✅ Chat inicializado con {len(self.corpus)} archivos cargados")
             
         except Exception as e:
             logger.error(f"❌ Error inicializando el chat: {str(e)}")
             self.model = None
+            self.router = None
             self.chat = None
     
+    def _build_preamble(self) -> List[Dict]:
+        """Context del sistema amb els arxius com a text, generat des del corpus"""
+        context = self.tenant.build_context(
+            self.corpus.full_text() if self.corpus and len(self.corpus) else "No s'han pogut carregar els arxius"
+        )
+        return [
+            {
+                "role": "user", 
+                "parts": [context]
+            },
+            {
+                "role": "model", 
+                "parts": [self.tenant.greeting]
+            }
+        ]
+    
+    @property
+    def request_count(self) -> int:
+        return self.store.get_counters(f"requests:{self.tenant.id}").get(f"requests:{self.tenant.id}", 0)
+    
+    def _session_key(self, user_data: Dict) -> Optional[str]:
+        """Clau de sessió per usuari i institut (None = historial local del procés)"""
+        session_id = user_data.get('session_id')
+        return f"{self.tenant.id}:{session_id}" if session_id else None
+    
+    @traced("bot.send_to_gemini")
     @retry_with_exponential_backoff(max_retries=1, initial_delay=3)
-    def _send_to_gemini(self, message: str) -> str:
+    def _send_to_gemini(self, message: str, session_key: Optional[str] = None, user: str = '',
+                        remember: bool = True, generation_config: Optional[Dict] = None) -> str:
         """Envia missatge a Gemini amb gestió d'errors"""
         if not self.chat:
             raise Exception("Chat no inicialitzat")
         
-        response = self.chat.send_message(message)
-        return response.text
+        # Torn just per usuari abans d'ocupar quota del model; si la cua és plena no es reintenta
+        try:
+            with self.shared.scheduler.slot(user or 'anonim'):
+                return self.chat.send_message(message, session_key, remember, generation_config)
+        except FairShareTimeout as e:
+            logger.warning(f"⏳ {str(e)}")
+            return SATURATED_MESSAGE
+    
+    def _answer_with_cache(self, question: str, full_message: str, session_key: Optional[str],
+                           user_name: str = '', user: str = '', stateless: bool = False,
+                           profile: str = 'open') -> str:
+        """Primera pregunta d'una sessió (o sense sessió): es reutilitza la resposta si ja s'ha fet abans"""
+        # Amb l'empremta del corpus: després d'actualitzar els arxius no es serveixen respostes antigues
+        corpus_digest = self.corpus.digest if self.corpus else ''
+        cache_key = f"{ANSWER_CACHE_PREFIX}{self.tenant.id}:{corpus_digest}:{normalize_question(question)}"
+        first_turn = stateless or not self.chat.get_history(session_key)
+        
+        if first_turn:
+            cached = self.store.cache_get(cache_key)
+            if cached is not None:
+                self.store.incr(f"answer_cache:{self.tenant.id}:hits")
+                if not stateless:
+                    self.chat.append(session_key, full_message, cached)
+                return cached
+            self.store.incr(f"answer_cache:{self.tenant.id}:misses")
+        
+        # Perfil de generació segons la intenció (pressupost de tokens i temperatura)
+        start = time.perf_counter()
+        response_text = self._send_to_gemini(
+            full_message, session_key, user, remember=not stateless,
+            generation_config=PROFILES[profile] if self.use_profiles else None
+        )
+        if "temporalment saturat" not in response_text:
+            record_generation(
+                self.store, profile if self.use_profiles else 'open',
+                (time.perf_counter() - start) * 1000, output_tokens(response_text)
+            )
+        
+        # No es desen les respostes de saturació ni les que esmenten l'usuari
+        first_name = user_name.split()[0] if user_name.split() else ''
+        personal = bool(first_name) and first_name.lower() in response_text.lower()
+        if first_turn and not personal and "temporalment saturat" not in response_text:
+            self.store.cache_set(cache_key, response_text, self.answer_cache_ttl)
+        return response_text
+    
+    def _should_degrade(self) -> bool:
+        """Mode degradat: forçat, o automàtic si el model falla o és massa lent"""
+        if self.degraded_mode == 'off':
+            return False
+        if self.degraded_mode == 'on' or not self.router:
+            return True
+        return self.router.is_degraded(self.degraded_latency)
     
+    @traced("bot.answer_locally")
+    def _answer_locally(self, message: str) -> Optional[str]:
+        """Resposta extractiva dels arxius descarregats, sense xarxa"""
+        if self.degraded_mode == 'off' or not self.corpus or not len(self.corpus):
+            return None
+        if self._extractive is None or self._extractive.corpus is not self.corpus:
+            self._extractive = ExtractiveAnswerer(self.corpus)
+        answer = self._extractive.answer(message)
+        if answer:
+            self.store.incr(f"degraded:{self.tenant.id}:answers")
+        return answer
+    
+    @traced("bot.process_message")
     def process_message(self, message: str, user_data: Dict) -> str:
-        """Procesa un mensaje del usuario"""
+        """Procesa un mensaje del usuario (amb user_data['stateless'], sense historial ni formularis)"""
         try:
             if not self.chat:
-                return "Ho sento, hi ha hagut un problema tècnic. Si us plau, recarrega la pàgina."
+                return self._answer_locally(message) or "Ho sento, hi ha hagut un problema tècnic. Si us plau, recarrega la pàgina."
+            
+            self.store.incr(f"requests:{self.tenant.id}")
             
             # Construir mensaje completo
             full_message = f"""IMPORTANT: Respon NOMÉS en català. Consulta la informació dels arxius per donar respostes precises.
@@ -347,19 +421,46 @@ RECORDA:
 - Respon sempre en CATALÀ
 - Sigues amable i professional"""
             
+            stateless = user_data.get('stateless', False)
+            
             # Verificar si es un formulario
             if self._is_form_submission(message):
+                if stateless:
+                    return "⚠️ Els formularis no es poden enviar fora del xat."
                 return self._handle_form_submission(message, user_data)
             
-            # Enviar a Gemini amb retry automàtic
-            response_text = self._send_to_gemini(full_message)
+            # Model no disponible o massa lent: resposta local immediata
+            if self._should_degrade():
+                local_answer = self._answer_locally(message)
+                if local_answer:
+                    return local_answer
+            
+            # Enviar a Gemini amb retry automàtic (o resposta de la cache compartida)
+            response_text = self._answer_with_cache(
+                message, full_message, None if stateless else self._session_key(user_data),
+                user_data.get('nom', ''), user_data.get('contacte', ''), stateless,
+                classify_intent(message)
+            )
+            
+            if "temporalment saturat" in response_text:
+                return self._answer_locally(message) or response_text
             
             return self._format_response(response_text)
             
+        except DeadlineExceeded:
+            # Sense temps per al model: resposta local si n'hi ha, si no la vista respon 504
+            local_answer = None if self._is_form_submission(message) else self._answer_locally(message)
+            if local_answer:
+                return local_answer
+            raise
         except Exception as e:
             error_msg = str(e)
             logger.error(f"❌ Error procesando mensaje: {error_msg}")
             
+            local_answer = None if self._is_form_submission(message) else self._answer_locally(message)
+            if local_answer:
+                return local_answer
+            
             # Retornar missatge específic si és error de quota
             if "temporalment saturat" in error_msg.lower():
                 return error_msg
@@ -380,15 +481,26 @@ RECORDA:
         """Controla els formularis i envia mails"""
         try:
             if "Justificar falta" in message:
-                return self._handle_absence_form(message, user_data)
+                form_type, handler = 'absence', self._handle_absence_form
             elif "Contactar professor" in message:
-                return self._handle_teacher_contact_form(message, user_data)
+                form_type, handler = 'teacher_contact', self._handle_teacher_contact_form
             else:
                 return "No s'ha pogut processar el formulari. Si us plau, torna-ho a intentar."
+            
+            # Un mateix formulari (clau del client o empremta dels camps) només s'envia una vegada
+            return self.forms.submit(
+                self.tenant.id, user_data.get('contacte', ''), form_type, message,
+                user_data.get('idempotency_key'),
+                lambda: handler(message, user_data),
+                succeeded=lambda result: result.startswith("✅")
+            )
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error manejando formulario: {str(e)}")
             return f"⚠️ Error al processar el formulari: {str(e)}"
     
+    @traced("bot.absence_form")
     def _handle_absence_form(self, message: str, user_data: Dict) -> str:
         """Procesa el formulari de faltes"""
         try:
@@ -435,21 +547,25 @@ Atentament,
 Contacte: {user_data.get('contacte', '')}
 
 ---
-Enviat automàticament des del sistema de l'Institut Alexandre de Riquer
+Enviat automàticament des del sistema de l'{self.tenant.name}
 {datetime.now().strftime('%d/%m/%Y %H:%M')}"""
             
             # Intentar enviar email
-            result = self.send_email(subject, body, ["abdellahbaghalbachiri@gmail.com"])
+            recipient = self.tenant.absence_recipient
+            result = self.send_email(subject, body, [recipient])
             
             if result["status"] == "success":
-                return f"✅ Justificació enviada correctament!\n\nDestinatari: abdellahbaghalbachiri@gmail.com\n\nEn breu rebràs confirmació de recepció."
+                return f"✅ Justificació enviada correctament!\n\nDestinatari: {recipient}\n\nEn breu rebràs confirmació de recepció."
             else:
-                return f"❌ Error al enviar la justificació.\n\nAlternatives:\n• Trucar al 93 868 04 14\n• Enviar email manualment a abdellahbaghalbachiri@gmail.com"
+                return f"❌ Error al enviar la justificació.\n\nAlternatives:\n• Trucar al {self.tenant.phone}\n• Enviar email manualment a {recipient}"
                 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error en justificació: {str(e)}")
             return f"⚠️ Error al processar la justificació: {str(e)}"
     
+    @traced("bot.teacher_contact_form")
     def _handle_teacher_contact_form(self, message: str, user_data: Dict) -> str:
         """Procesa el formulario de contacto con profesor"""
         try:
@@ -489,7 +605,7 @@ Enviat automàticament des del sistema de l'Institut Alexandre de Riquer
             else:
                 # Generar email automàticament (eliminar accents)
                 email_name = normalize_name_to_email(professor_name)
-                professor_email = f"{email_name}@inscalaf.cat"
+                professor_email = f"{email_name}@{self.tenant.email_domain}"
             
             logger.info(f"📧 Email generat: {professor_name} -> {professor_email}")
             
@@ -504,7 +620,7 @@ Atentament,
 {user_data.get('contacte', '')}
 
 ---
-Enviat automàticament des del sistema de l'Institut Alexandre de Riquer
+Enviat automàticament des del sistema de l'{self.tenant.name}
 {datetime.now().strftime('%d/%m/%Y %H:%M')}"""
             
             # Intentar enviar email
@@ -513,8 +629,10 @@ Enviat automàticament des del sistema de l'Institut Alexandre de Riquer
             if result["status"] == "success":
                 return f"✅ Missatge enviat correctament!\n\nDestinatari: {professor_email}\n\nEl professor/a rebrà el teu missatge i et respondrà al teu correu."
             else:
-                return f"❌ Error al enviar el missatge.\n\nAlternatives:\n• Trucar al 93 868 04 14\n• Enviar email directament a {professor_email}"
+                return f"❌ Error al enviar el missatge.\n\nAlternatives:\n• Trucar al {self.tenant.phone}\n• Enviar email directament a {professor_email}"
                 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error contactando profesor: {str(e)}")
             return f"⚠️ Error al contactar amb el professor: {str(e)}"
@@ -534,19 +652,64 @@ Enviat automàticament des del sistema de l'Institut Alexandre de Riquer
     def get_system_status(self) -> Dict:
         """Estado del sistema"""
         status = {
+            'tenant': self.tenant.id,
             'chat_initialized': self.chat is not None,
             'model_available': self.model is not None,
-            'files_loaded': len(self.file_contents),
+            'files_loaded': len(self.corpus) if self.corpus else 0,
             'api_key_configured': bool(os.environ.get("API_GEMINI")),
             'mailgun_configured': all([
                 os.environ.get("MAILGUN_API_KEY"),
                 os.environ.get("MAILGUN_DOMAIN")
             ]),
-            'total_requests': self.request_count
+            'total_requests': self.request_count,
+            'model_tiers': self.router.get_stats() if self.router else [],
+            'answer_cache': self.store.get_counters(f"answer_cache:{self.tenant.id}:"),
+            'degraded': self._should_degrade(),
+            'degraded_answers': self.store.get_counters(f"degraded:{self.tenant.id}:").get(f"degraded:{self.tenant.id}:answers", 0),
+            'form_submissions': self.forms.get_counters(self.tenant.id),
+            'corpus_minification': {
+                'files': self.corpus_report,
+                'tokens_before': sum(r['tokens_before'] for r in self.corpus_report.values()),
+                'tokens_after': sum(r['tokens_after'] for r in self.corpus_report.values()),
+            }
         }
         
         return status
     
+    def get_memory_report(self) -> Dict:
+        """Bytes residents per component (corpus, historial, configuració)"""
+        report = memory_report(
+            self.corpus or Corpus(''),
+            self.chat.history if self.chat else [],  # Historial local (les sessions d'usuari són a l'estat compartit)
+            extra={
+                'system_prompt': self.tenant.system_prompt,
+                'teachers': self.tenant.teachers,
+            }
+        )
+        report['after']['extractive_index'] = self.cache_bytes()
+        report['total_after'] += report['after']['extractive_index']
+        return report
+    
+    def close(self):
+        """Allibera el corpus mapat i l'índex extractiu (institut descarregat)"""
+        self._extractive = None
+        if self.corpus:
+            self.corpus.close()
+    
+    def cache_bytes(self) -> int:
+        """Bytes aproximats de les caches pròpies del bot (índex extractiu)"""
+        return self._extractive.nbytes if self._extractive else 0
+    
+    def drop_caches(self):
+        """Descarta l'índex extractiu; es reconstrueix quan torni a caldre"""
+        self._extractive = None
+    
+    def history_bytes(self) -> int:
+        return approx_bytes(self.chat.history) if self.chat else 0
+    
+    def compact_history(self, max_messages: int) -> int:
+        return self.chat.compact(max_messages) if self.chat else 0
+    
     def health_check(self) -> str:
         """Comprobación de salud del sistema"""
         status = self.get_system_status()
@@ -569,8 +732,15 @@ Enviat automàticament des del sistema de l'Institut Alexandre de Riquer
         
         return health_report
 
-# Crear instancia global
-bot = RiquerChatBot()
+# Instancia global, creada només quan es fa servir (app.py usa el registre d'instituts)
+_bot = None
+
+def get_default_bot() -> RiquerChatBot:
+    """Retorna la instancia global, creándola la primera vez"""
+    global _bot
+    if _bot is None:
+        _bot = RiquerChatBot()
+    return _bot
 
 # Funciones de utilidad para Flask
 def process_user_message(message: str, user_name: str, user_contact: str) -> str:
@@ -579,18 +749,18 @@ def process_user_message(message: str, user_name: str, user_contact: str) -> str
         'nom': user_name,
         'contacte': user_contact
     }
-    return bot.process_message(message, user_data)
+    return get_default_bot().process_message(message, user_data)
 
 def get_system_health() -> str:
     """Obtiene el estado de salud del sistema"""
-    return bot.health_check()
+    return get_default_bot().health_check()
 
 def get_teachers_for_form() -> List[Dict]:
     """Obtiene la lista de profesores para formularios"""
-    return bot.get_teachers_list()
+    return get_default_bot().get_teachers_list()
 
 def get_bot_status() -> Dict:
     """Obtiene el estado detallado del bot"""
-    return bot.get_system_status()
+    return get_default_bot().get_system_status()
 
 # Copyright (c) 2026 Abdellah Baghal. Todos los derechos reservados.
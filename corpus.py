@@ -0,0 +1,152 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Corpus dels arxius de l'institut guardat una sola vegada en UTF-8,
+en un fitxer mapat a memòria dins de drive_files/. Tots els consumidors
+llegeixen vistes (memoryview) sobre el mateix buffer.
+"""
+
+import os
+import sys
+import mmap
+import hashlib
+import tempfile
+import logging
+from typing import Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Corpus:
+    """Documents del corpus concatenats en un únic buffer UTF-8 mapat"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries = []  # (etiqueta, inici, fi) dins del buffer
+        self._file = None
+        self._buffer = b''
+        self.digest = ''  # Empremta del contingut (canvia en actualitzar els arxius)
+
+    @classmethod
+    def build(cls, path: str, documents: List[Tuple[str, str]]) -> "Corpus":
+        """Escriu els documents a disc i els mapa a memòria"""
+        corpus = cls(path)
+        offset = 0
+        hasher = hashlib.sha256()
+
+        # Fitxer temporal i os.replace: els mapes d'altres processos (o d'un bot
+        # anterior) conserven l'inode antic en lloc de veure'l truncat (SIGBUS).
+        # Es mapa el descriptor propi abans de reanomenar: si un altre worker
+        # escriu el mateix camí alhora, cada corpus conserva els seus bytes i offsets.
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+        f = os.fdopen(fd, 'w+b')
+        try:
+            for label, text in documents:
+                data = text.encode('utf-8')
+                f.write(data)
+                hasher.update(data)
+                corpus._entries.append((label, offset, offset + len(data)))
+                offset += len(data)
+            f.flush()
+            corpus.digest = hasher.hexdigest()[:16]
+            corpus._map(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            corpus.close()
+            f.close()
+            os.unlink(tmp_path)
+            raise
+
+        return corpus
+
+    def _map(self, f):
+        """Mapa el fitxer obert (se'n queda el descriptor fins a close())"""
+        self.close()
+        self._file = f
+        if self.nbytes:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            try:
+                self._buffer.close()
+            except BufferError:
+                # Encara hi ha vistes obertes: el mapa s'allibera quan es recullin
+                logger.debug(f"Corpus {self.path}: vistes obertes, el mapa es tancarà en alliberar-les")
+        self._buffer = b''
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._entries[-1][2] if self._entries else 0
+
+    def labels(self) -> List[str]:
+        return [label for label, _, _ in self._entries]
+
+    def view(self, index: int) -> memoryview:
+        """Vista sense còpia sobre els bytes d'un document"""
+        _, start, end = self._entries[index]
+        return memoryview(self._buffer)[start:end]
+
+    def documents(self) -> Iterator[Tuple[str, memoryview]]:
+        for index, (label, _, _) in enumerate(self._entries):
+            yield label, self.view(index)
+
+    def text(self, index: int) -> str:
+        return str(self.view(index), 'utf-8')
+
+    def full_text(self) -> str:
+        """Text complet decodificat; només s'ha de fer servir de forma transitòria"""
+        return str(memoryview(self._buffer)[:self.nbytes], 'utf-8')
+
+
+def approx_bytes(value) -> int:
+    """Bytes aproximats que ocupa un objecte str/list/dict de Python"""
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approx_bytes(k) + approx_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(approx_bytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def memory_report(corpus: Corpus, history: List[Dict], extra: Dict = None) -> Dict:
+    """Bytes residents per component i estimació de la representació anterior
+
+    Abans el corpus es guardava com a str a file_contents, al context unit,
+    dins de l'historial del xat, i tot plegat per duplicat (dues instàncies del bot).
+    La columna "before_estimate" no és cap mesura: es calcula amb la mida del corpus.
+    """
+    # Mida aproximada del corpus com a str (1 byte per caràcter llatí), sense decodificar-lo
+    corpus_text_bytes = sys.getsizeof('') + corpus.nbytes if len(corpus) else 0
+    history_bytes = approx_bytes(history)
+
+    after = {
+        'corpus_mmap': corpus.nbytes,
+        'chat_history': history_bytes,
+    }
+    for name, value in (extra or {}).items():
+        after[name] = approx_bytes(value)
+
+    before_estimate = {
+        'file_contents': corpus_text_bytes,
+        'context_string': corpus_text_bytes,
+        'chat_history': corpus_text_bytes + history_bytes,
+        'duplicate_bot_instance': 3 * corpus_text_bytes + history_bytes,
+    }
+
+    return {
+        'before_estimate': before_estimate,
+        'after': after,
+        'total_before_estimate': sum(before_estimate.values()),
+        'total_after': sum(after.values()),
+    }
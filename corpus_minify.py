@@ -0,0 +1,184 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Minimització dels arxius de Drive abans de construir el context: codificació
+normalitzada (BOM, NFC), sense HTML, taules compactes (sense columnes buides,
+columnes constants plegades en una línia, files duplicades eliminades) i
+espais col·lapsats. Cada arxiu informa dels tokens estimats abans i després;
+si la taula compacta perd algun valor, es fa servir el text original netejat.
+"""
+
+import io
+import re
+import csv
+import html
+import logging
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BOMS = [
+    (b'\xef\xbb\xbf', 'utf-8'),
+    (b'\xff\xfe', 'utf-16-le'),
+    (b'\xfe\xff', 'utf-16-be'),
+]
+
+TAG_RE = re.compile(r'<(?:/?[a-zA-Z][a-zA-Z0-9]*\b[^<>]*|!--.*?--)>', re.DOTALL)
+BLOCK_TAG_RE = re.compile(r'<(?:br|/p|/div|/tr|/li|/h[1-6])\b[^<>]*>', re.IGNORECASE)
+SCRIPT_RE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+SPACES_RE = re.compile(r'[ \t\f\v\u00a0\u2007\u202f]+')
+INVISIBLE_RE = re.compile(r'[\u200b\u200c\u200d\u2060\ufeff]')
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+CELL_SEPARATOR = '|'
+
+
+def escape_cell(cell: str) -> str:
+    """Escapa el separador (i la barra inversa) perquè cada fila es pugui tornar a separar"""
+    return cell.replace('\\', '\\\\').replace(CELL_SEPARATOR, '\\' + CELL_SEPARATOR)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimació de tokens (~4 caràcters per token, com a output_tokens)"""
+    return len(text) // 4
+
+
+def decode(content: bytes) -> str:
+    """Bytes a text: BOM si n'hi ha, si no UTF-8, cp1252 o latin-1; sempre en NFC"""
+    for bom, encoding in BOMS:
+        if content.startswith(bom):
+            text = content[len(bom):].decode(encoding, errors='replace')
+            break
+    else:
+        for encoding in ('utf-8', 'cp1252', 'latin-1'):
+            try:
+                text = content.decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return unicodedata.normalize('NFC', INVISIBLE_RE.sub('', text))
+
+
+def strip_html(text: str) -> str:
+    """Treu etiquetes HTML soltes i desfà les entitats (&amp;, &nbsp;...)"""
+    if not TAG_RE.search(text) and '&' not in text:
+        return text
+    text = SCRIPT_RE.sub('', text)
+    text = BLOCK_TAG_RE.sub('\n', text)
+    text = TAG_RE.sub('', text)
+    return html.unescape(text)
+
+
+def collapse_whitespace(text: str) -> str:
+    """Espais i tabuladors repetits a un, sense espais a final de línia ni blocs de línies buides"""
+    lines = [SPACES_RE.sub(' ', line).strip() for line in text.split('\n')]
+    # Línies idèntiques consecutives (capçaleres repetides, separadors...)
+    deduped = [line for i, line in enumerate(lines) if i == 0 or not line or line != lines[i - 1]]
+    return BLANK_LINES_RE.sub('\n\n', '\n'.join(deduped)).strip()
+
+
+def _clean_cell(cell: str) -> str:
+    return SPACES_RE.sub(' ', cell.replace('\n', ' ')).strip()
+
+
+def parse_table(text: str) -> Optional[List[List[str]]]:
+    """Files d'un CSV/TSV, o None si el text no té forma de taula"""
+    sample = text[:8192]
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        return None
+
+    rows = [[_clean_cell(cell) for cell in row] for row in csv.reader(io.StringIO(text), dialect)]
+    rows = [row for row in rows if any(row)]
+    if len(rows) < 2:
+        return None
+
+    # La majoria de files han de tenir el mateix nombre de columnes (i més d'una)
+    width, count = Counter(len(row) for row in rows).most_common(1)[0]
+    if width < 2 or count < 0.8 * len(rows):
+        return None
+
+    width = max(len(row) for row in rows)
+    return [row + [''] * (width - len(row)) for row in rows]
+
+
+def minify_table(rows: List[List[str]]) -> Tuple[str, Dict]:
+    """Taula compacta: columnes buides fora, constants plegades, files úniques"""
+    header, data = rows[0], rows[1:]
+    stats = {'columns_dropped': 0, 'columns_folded': 0, 'rows_deduped': 0}
+
+    # Capçaleres repetides dins de les dades i files duplicades
+    seen = set()
+    unique = []
+    for row in data:
+        key = tuple(row)
+        if row == header or key in seen:
+            stats['rows_deduped'] += 1
+            continue
+        seen.add(key)
+        unique.append(row)
+
+    keep = []
+    folded = []
+    for col, name in enumerate(header):
+        values = {row[col] for row in unique}
+        if values <= {''}:
+            # Columna sense cap valor: la capçalera sola no aporta res
+            stats['columns_dropped'] += 1
+            continue
+        if len(unique) > 1 and len(values) == 1:
+            value = values.pop()
+            folded.append(f"{name}: {value}" if name else value)
+            stats['columns_folded'] += 1
+            continue
+        keep.append(col)
+
+    lines = folded[:]
+    if keep:
+        lines.append(CELL_SEPARATOR.join(escape_cell(header[col]) for col in keep))
+        lines.extend(CELL_SEPARATOR.join(escape_cell(row[col]) for col in keep) for row in unique)
+    return '\n'.join(lines), stats
+
+
+def lost_values(rows: List[List[str]], text: str) -> List[str]:
+    """Valors de la taula original que no apareixen al text minimitzat
+
+    Es comproven totes les cel·les amb dades i les capçaleres de les columnes
+    que en tenen (una capçalera d'una columna buida no és cap dada).
+    """
+    header = rows[0]
+    data = [row for row in rows[1:] if row != header]
+    values = {cell for row in data for cell in row if cell}
+    values.update(name for col, name in enumerate(header) if name and any(row[col] for row in data))
+    return sorted(value for value in values if value not in text and escape_cell(value) not in text)
+
+
+def minify_document(content: bytes) -> Tuple[str, Dict]:
+    """Text minimitzat d'un arxiu i informe de tokens abans/després"""
+    raw = decode(content)
+    text = strip_html(raw)
+    report = {'kind': 'text', 'tokens_before': estimate_tokens(raw)}
+
+    rows = parse_table(text)
+    if rows:
+        table, stats = minify_table(rows)
+        missing = lost_values(rows, table)
+        if missing:
+            logger.warning(f"Minimització de taula descartada: {len(missing)} valors perduts (p. ex. {missing[0]!r})")
+        else:
+            text = table
+            report.update(stats, kind='table')
+
+    if report['kind'] == 'text':
+        text = collapse_whitespace(text)
+
+    report['tokens_after'] = estimate_tokens(text)
+    report['saved_pct'] = round(
+        100 * (1 - report['tokens_after'] / report['tokens_before']), 1
+    ) if report['tokens_before'] else 0.0
+    return text, report
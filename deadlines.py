@@ -0,0 +1,114 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Termini (deadline) per petició: es crea a la vista de Flask i es propaga amb
+contextvars a totes les crides sortints, reintents i esperes, que només fan
+servir el temps que queda. Es compten els excessos de termini per etapa.
+"""
+
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_deadline = contextvars.ContextVar('current_deadline', default=None)
+
+# Marge per considerar que el termini ja s'ha esgotat quan arriba l'error d'una crida
+EXPIRY_MARGIN = 0.05
+TIMEOUT_KEYWORDS = ('timeout', 'timed out', 'deadline')
+
+
+class DeadlineExceeded(Exception):
+    """S'ha esgotat el temps de la petició"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Termini de la petició esgotat ({stage})")
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, budget: float, clock=time.monotonic):
+        self.budget = budget
+        self._clock = clock
+        self.expires_at = clock() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - self._clock())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+def record_overrun(stage: str):
+    """Comptador compartit d'excessos de termini per etapa"""
+    from shared_state import get_state_store
+
+    logger.warning(f"⏰ Termini esgotat a l'etapa '{stage}'")
+    try:
+        get_state_store().incr(f"deadline:{stage}:overruns")
+    except Exception as e:
+        logger.warning(f"No s'ha pogut registrar l'excés de termini: {str(e)}")
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(budget: float):
+    """Estableix el termini de la petició actual"""
+    token = _current_deadline.set(Deadline(budget))
+    try:
+        yield _current_deadline.get()
+    finally:
+        _current_deadline.reset(token)
+
+
+def check(stage: str):
+    """Llança DeadlineExceeded si el termini ja s'ha esgotat"""
+    deadline = _current_deadline.get()
+    if deadline and deadline.expired:
+        record_overrun(stage)
+        raise DeadlineExceeded(stage)
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Temps que queda; sense termini actiu, el valor per defecte"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline else default
+
+
+def caused_by_deadline(error: BaseException) -> bool:
+    """Cert si l'error d'una crida sortint es deu al termini de la petició
+
+    Amb un termini actiu, el timeout de la crida és el temps restant: un error de
+    timeout (o qualsevol error quan ja no queda temps) és culpa del termini, no del servei.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return False
+    if deadline.remaining() <= EXPIRY_MARGIN or isinstance(error, TimeoutError):
+        return True
+    description = f"{type(error).__name__} {error}".lower()
+    return any(keyword in description for keyword in TIMEOUT_KEYWORDS)
+
+
+def bounded_timeout(stage: str, default: Optional[float]) -> Optional[float]:
+    """Timeout per a una crida: el mínim entre el seu valor propi i el temps restant"""
+    check(stage)
+    left = remaining()
+    if left is None:
+        return default
+    return left if default is None else min(default, left)
+
+
+def overrun_report(store) -> Dict[str, int]:
+    return {
+        name.split(':')[1]: value
+        for name, value in store.get_counters('deadline:').items()
+    }
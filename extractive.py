@@ -0,0 +1,146 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Motor de respostes extractiu i local per al mode degradat: quan Gemini no
+està disponible, es classifiquen els fragments del corpus amb BM25 sobre
+termes sense accents i es retornen els millors amb l'arxiu d'origen.
+"""
+
+import re
+import sys
+import math
+import time
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from corpus import Corpus
+from text_utils import fold_accents
+
+logger = logging.getLogger(__name__)
+
+# Paraules buides en català i castellà que no aporten res a la cerca
+STOPWORDS = {
+    'a', 'al', 'als', 'amb', 'de', 'del', 'dels', 'el', 'els', 'en', 'es', 'i', 'la', 'les', 'l', 'd',
+    'per', 'que', 'qui', 'quin', 'quina', 'quins', 'quines', 'com', 'on', 'un', 'una', 'uns', 'unes',
+    'o', 'no', 'hi', 'ho', 'se', 'si', 'te', 'pel', 'pels', 'sobre', 'meu', 'meva', 'teu', 'teva',
+    'y', 'lo', 'los', 'las', 'por', 'para', 'con', 'cual', 'cuando', 'donde', 'como',
+    'puc', 'pot', 'vull', 'saber', 'fer', 'tinc', 'hola', 'gracies',
+}
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Termes sense accents ni paraules buides"""
+    return [
+        token for token in TOKEN_RE.findall(fold_accents(text))
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+class ExtractiveAnswerer:
+    """Índex invertit BM25 sobre els fragments (línies o paràgrafs) del corpus"""
+
+    def __init__(self, corpus: Corpus, max_passage_bytes: int = 600, k1: float = 1.2, b: float = 0.75):
+        self.corpus = corpus
+        self.k1 = k1
+        self.b = b
+        self._passages = []  # (document, inici, fi) en bytes dins del document
+        self._lengths = []
+        self._postings = defaultdict(list)  # terme -> [(fragment, freqüència)]
+
+        start = time.perf_counter()
+        for doc_index, (_, view) in enumerate(corpus.documents()):
+            for begin, end in self._split(bytes(view), max_passage_bytes):
+                text = bytes(view[begin:end]).decode('utf-8', errors='ignore')
+                tokens = tokenize(text)
+                if not tokens:
+                    continue
+                passage_id = len(self._passages)
+                self._passages.append((doc_index, begin, end))
+                self._lengths.append(len(tokens))
+                for term, freq in Counter(tokens).items():
+                    self._postings[term].append((passage_id, freq))
+
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0
+        self.nbytes = self._estimate_bytes()
+        logger.info(
+            f"🔎 Índex extractiu: {len(self._passages)} fragments, {len(self._postings)} termes "
+            f"({(time.perf_counter() - start) * 1000:.0f}ms)"
+        )
+
+    def _estimate_bytes(self) -> int:
+        """Bytes aproximats de l'índex (fragments, longituds i postings)"""
+        total = sys.getsizeof(self._passages) + sys.getsizeof(self._lengths) + sys.getsizeof(self._postings)
+        total += sum(sys.getsizeof(passage) for passage in self._passages)
+        for term, postings in self._postings.items():
+            total += sys.getsizeof(term) + sys.getsizeof(postings) + sum(sys.getsizeof(p) for p in postings)
+        return total
+
+    @staticmethod
+    def _split(data: bytes, max_bytes: int) -> List[Tuple[int, int]]:
+        """Fragments per línia; les línies llargues es tallen per frases"""
+        spans = []
+        offset = 0
+        for line in data.split(b'\n'):
+            begin, end = offset, offset + len(line)
+            offset = end + 1
+            while end - begin > max_bytes:
+                cut = data.rfind(b'. ', begin, begin + max_bytes)
+                cut = cut + 1 if cut > begin else begin + max_bytes
+                # No tallar un caràcter UTF-8 per la meitat
+                while cut < end and (data[cut] & 0xC0) == 0x80:
+                    cut += 1
+                spans.append((begin, cut))
+                begin = cut
+            if data[begin:end].strip():
+                spans.append((begin, end))
+        return spans
+
+    def search(self, question: str, top_k: int = 3) -> List[Tuple[float, int]]:
+        """Fragments amb més puntuació BM25 per a la pregunta"""
+        terms = set(tokenize(question))
+        total = len(self._passages)
+        scores = defaultdict(float)
+
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for passage_id, freq in postings:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[passage_id] / self._avg_length)
+                scores[passage_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+
+        return sorted(((score, pid) for pid, score in scores.items()), reverse=True)[:top_k]
+
+    def passage_text(self, passage_id: int) -> Tuple[str, str]:
+        doc_index, begin, end = self._passages[passage_id]
+        view = self.corpus.view(doc_index)
+        text = bytes(view[begin:end]).decode('utf-8', errors='ignore')
+        return self.corpus.labels()[doc_index], " ".join(text.split())
+
+    def answer(self, question: str, top_k: int = 3) -> Optional[str]:
+        """Resposta ràpida amb els millors fragments i el seu origen, o None"""
+        results = self.search(question, top_k)
+        if not results:
+            return None
+        # Es descarten els fragments molt per sota del millor
+        results = [result for result in results if result[0] >= 0.3 * results[0][0]]
+
+        lines = ["⚡ Ara mateix el servei complet no està disponible. "
+                 "Això és el que he trobat als arxius de l'institut:\n"]
+        for _, passage_id in results:
+            source, text = self.passage_text(passage_id)
+            lines.append(f"• {text} ({source})")
+        lines.append("\nSi necessites més detall, torna-ho a provar d'aquí a una estona.")
+        return "\n".join(lines)
+
+    def get_stats(self) -> Dict:
+        return {
+            'passages': len(self._passages),
+            'terms': len(self._postings),
+            'bytes': self.nbytes,
+        }
@@ -0,0 +1,205 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Repartiment just de la quota de Gemini entre usuaris: límit de peticions
+per usuari (token bucket) i cua amb weighted fair queuing per a les crides
+al model, de manera que els usuaris intensius s'alenteixen sense afectar
+la resta. El personal del centre pot tenir més pes.
+"""
+
+import os
+import time
+import heapq
+import itertools
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+import deadlines
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class FairShareTimeout(Exception):
+    """No s'ha obtingut torn per cridar el model dins del temps d'espera
+
+    És una saturació local, no un error de quota de Gemini: no s'ha de reintentar.
+    """
+
+
+class FairShareScheduler:
+    """Límit per usuari i cua justa ponderada per a les crides al model"""
+
+    def __init__(self, concurrency: int = 4, rate_per_minute: float = 10, burst: float = 5,
+                 staff_weight: float = 3, staff_domains: Iterable[str] = (),
+                 weights: Optional[Dict[str, float]] = None, max_wait: float = 30,
+                 store=None, clock=time.monotonic):
+        self.concurrency = concurrency
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.staff_weight = staff_weight
+        self.staff_domains = {domain.lower() for domain in staff_domains}
+        self.weights = {k.lower(): v for k, v in (weights or {}).items()}
+        self.max_wait = max_wait
+        self.store = store
+        self._clock = clock
+
+        self._buckets = {}  # usuari -> (tokens, instant)
+        self._bucket_lock = threading.Lock()
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._virtual_time = 0.0
+        self._last_finish = {}  # usuari -> etiqueta de finalització
+        self._waiting = []  # heap de (etiqueta, seq)
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_env(cls, store=None) -> "FairShareScheduler":
+        """FAIR_SHARE_CONCURRENCY, USER_RATE_PER_MINUTE, USER_BURST, STAFF_WEIGHT,
+        FAIR_SHARE_MAX_WAIT i USER_WEIGHTS ("email:pes,email:pes")"""
+        weights = {}
+        for item in os.environ.get('USER_WEIGHTS', '').split(','):
+            if ':' in item:
+                email, weight = item.rsplit(':', 1)
+                try:
+                    weights[email.strip()] = float(weight)
+                except ValueError:
+                    logger.warning(f"USER_WEIGHTS: pes no vàlid per {email}")
+
+        return cls(
+            concurrency=int(os.environ.get('FAIR_SHARE_CONCURRENCY', 4)),
+            rate_per_minute=float(os.environ.get('USER_RATE_PER_MINUTE', 10)),
+            burst=float(os.environ.get('USER_BURST', 5)),
+            staff_weight=float(os.environ.get('STAFF_WEIGHT', 3)),
+            weights=weights,
+            max_wait=float(os.environ.get('FAIR_SHARE_MAX_WAIT', 30)),
+            store=store
+        )
+
+    def weight(self, user: str) -> float:
+        """Pes de l'usuari: explícit, de personal (per domini) o 1"""
+        user = (user or '').lower()
+        if user in self.weights:
+            return self.weights[user]
+        if user.rsplit('@', 1)[-1] in self.staff_domains:
+            return self.staff_weight
+        return 1.0
+
+    def _record(self, user: str, metric: str, amount: int = 1):
+        if self.store and user:
+            try:
+                self.store.incr(f"usage:{user.lower()}:{metric}", amount)
+            except Exception as e:
+                logger.warning(f"No s'ha pogut registrar l'ús de {user}: {str(e)}")
+
+    def _bucket_full(self, user: str, tokens: float, elapsed: float) -> bool:
+        """Cert si el bucket de l'usuari ja s'ha recarregat del tot (amb el seu propi pes)"""
+        weight = self.weight(user)
+        return tokens + elapsed * self.rate_per_minute * weight / 60.0 >= self.burst * weight
+
+    def check_rate(self, user: str) -> Optional[float]:
+        """Consumeix un testimoni; retorna els segons d'espera si l'usuari ha superat el límit"""
+        weight = self.weight(user)
+        rate = self.rate_per_minute * weight / 60.0
+        capacity = self.burst * weight
+        now = self._clock()
+
+        with self._bucket_lock:
+            tokens, last = self._buckets.get(user, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+
+            if tokens < 1:
+                self._buckets[user] = (tokens, now)
+                retry_after = (1 - tokens) / rate if rate > 0 else self.max_wait
+            else:
+                self._buckets[user] = (tokens - 1, now)
+                retry_after = None
+
+            # Els buckets plens equivalen a no tenir-ne: es poden descartar
+            if len(self._buckets) > 10000:
+                self._buckets = {
+                    key: (t, at) for key, (t, at) in self._buckets.items()
+                    if not self._bucket_full(key, t, now - at)
+                }
+
+        self._record(user, 'requests')
+        if retry_after is not None:
+            self._record(user, 'throttled')
+        return retry_after
+
+    @contextmanager
+    def slot(self, user: str, cost: float = 1.0, timeout: Optional[float] = None):
+        """Espera torn per a una crida al model segons l'etiqueta de finalització virtual"""
+        timeout = self.max_wait if timeout is None else timeout
+        # Mai més enllà del termini de la petició
+        request_left = deadlines.remaining()
+        limited_by_request = request_left is not None and request_left < timeout
+        if limited_by_request:
+            timeout = request_left
+        start = self._clock()
+        deadline = time.monotonic() + timeout
+
+        with span("fair_share.wait", user=user), self._cond:
+            begin = max(self._virtual_time, self._last_finish.get(user, 0.0))
+            tag = begin + cost / self.weight(user)
+            self._last_finish[user] = tag
+            entry = (tag, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+
+            while self._active >= self.concurrency or self._waiting[0] != entry:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    self._record(user, 'timeouts')
+                    if limited_by_request:
+                        deadlines.record_overrun('fair_share')
+                        raise deadlines.DeadlineExceeded('fair_share')
+                    raise FairShareTimeout(f"Cua de crides al model plena: sense torn per a {user} després de {timeout:.0f}s")
+                self._cond.wait(remaining)
+
+            heapq.heappop(self._waiting)
+            self._active += 1
+            self._virtual_time = max(self._virtual_time, begin)
+
+            # Els usuaris que ja no estan per davant del temps virtual no cal recordar-los
+            if len(self._last_finish) > 1000:
+                self._last_finish = {
+                    key: value for key, value in self._last_finish.items() if value > self._virtual_time
+                }
+
+        waited_ms = int((self._clock() - start) * 1000)
+        self._record(user, 'model_calls')
+        if waited_ms:
+            self._record(user, 'queued_ms', waited_ms)
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def get_status(self) -> Dict:
+        with self._cond:
+            return {
+                'active': self._active,
+                'waiting': len(self._waiting),
+                'concurrency': self.concurrency,
+            }
+
+    def get_usage(self) -> Dict[str, Dict[str, int]]:
+        """Comptadors d'ús per usuari (compartits entre workers si el store ho és)"""
+        usage = {}
+        if not self.store:
+            return usage
+        for name, value in self.store.get_counters('usage:').items():
+            _, rest = name.split(':', 1)
+            user, metric = rest.rsplit(':', 1)
+            usage.setdefault(user, {})[metric] = value
+        return usage
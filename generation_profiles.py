@@ -0,0 +1,83 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Perfils de generació per intenció: les preguntes curtes i factuals tenen
+un pressupost de tokens petit i temperatura baixa; les obertes, més marge.
+Un classificador lleuger decideix el perfil abans de cridar Gemini.
+"""
+
+import re
+import logging
+from typing import Dict
+
+from text_utils import normalize_question
+
+logger = logging.getLogger(__name__)
+
+PROFILES = {
+    # Sí/no, horaris, dades de contacte...
+    'short': {
+        "temperature": 0.2,
+        "top_p": 0.9,
+        "top_k": 20,
+        "max_output_tokens": 256,
+    },
+    'standard': {
+        "temperature": 0.5,
+        "top_p": 0.95,
+        "top_k": 40,
+        "max_output_tokens": 640,
+    },
+    # Procediments, matrícula, explicacions (configuració original)
+    'open': {
+        "temperature": 0.7,
+        "top_p": 0.95,
+        "top_k": 40,
+        "max_output_tokens": 1024,
+    },
+}
+
+SHORT_PATTERNS = re.compile(
+    r"\b(horari|horaris|hora|hores|quan|quin dia|telefon|correu|email|adreca|on es|on esta|"
+    r"obre|tanca|obert|tancat|festiu|festa|vacances|aula|tutor|tutora|hi ha|es pot|puc)\b"
+)
+OPEN_PATTERNS = re.compile(
+    r"\b(explica|expliqueu|com puc|com es fa|com funciona|procediment|passos|tramit|"
+    r"matricula|preinscripcio|beca|beques|requisits|diferencia|diferencies|per que|"
+    r"avantatges|recomana|opcions|itinerari|optatives)\b"
+)
+
+
+def classify_intent(message: str) -> str:
+    """Perfil per a una pregunta: 'short', 'standard' o 'open'"""
+    text = normalize_question(message)
+    words = len(text.split())
+
+    if OPEN_PATTERNS.search(text) or words > 25:
+        return 'open'
+    if SHORT_PATTERNS.search(text) and words <= 12:
+        return 'short'
+    return 'standard'
+
+
+def record_generation(store, profile: str, latency_ms: float, output_tokens: int):
+    """Acumula latència i tokens de sortida per perfil a l'estat compartit"""
+    store.incr(f"profile:{profile}:count")
+    store.incr(f"profile:{profile}:latency_ms", int(latency_ms))
+    store.incr(f"profile:{profile}:output_tokens", int(output_tokens))
+
+
+def profile_report(store) -> Dict[str, Dict[str, float]]:
+    """Mitjanes de tokens de sortida i latència per perfil"""
+    report = {}
+    for name, value in store.get_counters('profile:').items():
+        _, profile, metric = name.split(':')
+        report.setdefault(profile, {})[metric] = value
+
+    for profile, values in report.items():
+        count = values.get('count', 0)
+        values['avg_output_tokens'] = round(values.get('output_tokens', 0) / count, 1) if count else 0.0
+        values['avg_latency_ms'] = round(values.get('latency_ms', 0) / count, 1) if count else 0.0
+        values['max_output_tokens'] = PROFILES.get(profile, {}).get('max_output_tokens')
+    return report
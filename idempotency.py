@@ -0,0 +1,135 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Enviaments de formularis idempotents: el client envia una clau única per
+formulari (Idempotency-Key) i el servidor calcula a més una empremta amb
+l'usuari, el tipus de formulari i els camps normalitzats. Un duplicat dins
+de la finestra rep el resultat original sense tornar a enviar el correu;
+si l'original encara s'està enviant, l'espera.
+"""
+
+import os
+import time
+import hashlib
+import logging
+from typing import Callable, Dict, List, Optional
+
+import deadlines
+from text_utils import normalize_question
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+
+
+class FormDeduplicator:
+    """Supressió de formularis duplicats amb la cache de l'estat compartit"""
+
+    def __init__(self, store, window: float = 600, pending_ttl: float = 60,
+                 wait_timeout: float = 20, poll_interval: float = 0.25):
+        self.store = store
+        self.window = window
+        self.pending_ttl = pending_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+
+    @classmethod
+    def from_env(cls, store) -> "FormDeduplicator":
+        """FORM_DEDUP_WINDOW i FORM_DEDUP_WAIT (segons)"""
+        return cls(
+            store,
+            window=float(os.environ.get('FORM_DEDUP_WINDOW', 600)),
+            wait_timeout=float(os.environ.get('FORM_DEDUP_WAIT', 20))
+        )
+
+    @staticmethod
+    def fingerprint(scope: str, user: str, form_type: str, message: str) -> str:
+        raw = f"{scope}|{(user or '').lower()}|{form_type}|{normalize_question(message)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _keys(self, scope: str, user: str, form_type: str, message: str,
+              idempotency_key: Optional[str]) -> List[str]:
+        keys = []
+        if idempotency_key:
+            keys.append(f"form:key:{scope}:{(user or '').lower()}:{idempotency_key}")
+        keys.append(f"form:fp:{self.fingerprint(scope, user, form_type, message)}")
+        return keys
+
+    def _record(self, scope: str, form_type: str, metric: str):
+        try:
+            self.store.incr(f"forms:{scope}:{form_type}:{metric}")
+        except Exception as e:
+            logger.warning(f"No s'ha pogut registrar {metric} del formulari: {str(e)}")
+
+    def _claim(self, keys: List[str]) -> Optional[str]:
+        """Reserva totes les claus; si alguna ja existeix, allibera les reservades i la retorna"""
+        claimed = []
+        for key in keys:
+            if not self.store.cache_add(key, {'state': PENDING}, self.pending_ttl):
+                for own in claimed:
+                    self.store.cache_delete(own)
+                return key
+            claimed.append(key)
+        return None
+
+    def _wait(self, key: str) -> Optional[Dict]:
+        """Espera el resultat de l'enviament original; None si ha desaparegut (ha fallat)"""
+        timeout = deadlines.remaining(self.wait_timeout)
+        give_up = time.monotonic() + min(timeout, self.wait_timeout)
+        while True:
+            entry = self.store.cache_get(key)
+            if entry is None or entry.get('state') == DONE:
+                return entry
+            if time.monotonic() >= give_up:
+                return {'state': PENDING}
+            time.sleep(self.poll_interval)
+
+    def submit(self, scope: str, user: str, form_type: str, message: str,
+               idempotency_key: Optional[str], send: Callable[[], str],
+               succeeded: Callable[[str], bool]) -> str:
+        """Executa send() una sola vegada per formulari; els duplicats reben el mateix resultat"""
+        keys = self._keys(scope, user, form_type, message, idempotency_key)
+
+        while True:
+            existing = self._claim(keys)
+            if existing is None:
+                break
+
+            entry = self._wait(existing)
+            if entry is None:
+                # L'original ha fallat i ha alliberat les claus: es pot tornar a provar
+                continue
+            if entry['state'] == DONE:
+                logger.info(f"🔁 Formulari {form_type} duplicat de {user}: es retorna el resultat original")
+                self._record(scope, form_type, 'suppressed')
+                return entry['result']
+
+            self._record(scope, form_type, 'wait_timeouts')
+            return "⏳ Aquest formulari ja s'està enviant. Espera uns segons abans de tornar-ho a provar."
+
+        try:
+            result = send()
+        except BaseException:
+            for key in keys:
+                self.store.cache_delete(key)
+            raise
+
+        if succeeded(result):
+            for key in keys:
+                self.store.cache_set(key, {'state': DONE, 'result': result}, self.window)
+            self._record(scope, form_type, 'sent')
+        else:
+            # Els errors no es recorden: l'usuari ha de poder tornar-ho a enviar
+            for key in keys:
+                self.store.cache_delete(key)
+            self._record(scope, form_type, 'failed')
+        return result
+
+    def get_counters(self, scope: str) -> Dict[str, Dict[str, int]]:
+        report = {}
+        for name, value in self.store.get_counters(f"forms:{scope}:").items():
+            _, _, form_type, metric = name.split(':')
+            report.setdefault(form_type, {})[metric] = value
+        return report
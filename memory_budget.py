@@ -0,0 +1,161 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Pressupost de memòria del procés: cada component (corpus, converses, caches)
+informa dels bytes aproximats que ocupa i, si el total supera el pressupost,
+s'allibera per ordre de prioritat: primer les caches, després es compacten
+les converses i, en últim cas, es descarten les més antigues.
+"""
+
+import os
+import time
+import threading
+import logging
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def process_rss() -> Optional[int]:
+    """Memòria resident del procés (Linux); None si no es pot llegir"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def tracemalloc_snapshot(limit: int = 10) -> Dict:
+    """Línies de codi amb més memòria assignada (cal MEMORY_TRACEMALLOC)"""
+    if not tracemalloc.is_tracing():
+        return {'enabled': False}
+    current, peak = tracemalloc.get_traced_memory()
+    stats = tracemalloc.take_snapshot().statistics('lineno')[:limit]
+    return {
+        'enabled': True,
+        'current': current,
+        'peak': peak,
+        'top': [
+            {'location': str(stat.traceback[0]), 'bytes': stat.size, 'blocks': stat.count}
+            for stat in stats
+        ],
+    }
+
+
+class MemoryBudget:
+    """Comptabilitat aproximada per component i alliberament per prioritat"""
+
+    def __init__(self, budget_bytes: int = 0, check_interval: float = 30, store=None, clock=time.monotonic):
+        self.budget_bytes = budget_bytes
+        self.check_interval = check_interval
+        self.store = store
+        self._clock = clock
+        self._components = {}  # nom -> funció que retorna bytes
+        self._steps = []  # (prioritat, etiqueta, component, funció d'alliberament)
+        self._last_check = clock()
+        self._check_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, store=None) -> "MemoryBudget":
+        """MEMORY_BUDGET_MB (0 = sense límit), MEMORY_CHECK_INTERVAL i MEMORY_TRACEMALLOC (frames)"""
+        frames = int(os.environ.get('MEMORY_TRACEMALLOC', 0))
+        if frames and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.info(f"🧠 tracemalloc actiu ({frames} frames)")
+
+        return cls(
+            budget_bytes=int(float(os.environ.get('MEMORY_BUDGET_MB', 256)) * 1024 * 1024),
+            check_interval=float(os.environ.get('MEMORY_CHECK_INTERVAL', 30)),
+            store=store
+        )
+
+    def track(self, name: str, size: Callable[[], int]):
+        """Registra un component amb la funció que estima els seus bytes"""
+        self._components[name] = size
+
+    def shed_with(self, label: str, component: str, shed: Callable[[], object], priority: int):
+        """Registra un pas d'alliberament sobre un component (prioritat baixa = primer)"""
+        self._steps.append((priority, label, component, shed))
+        self._steps.sort(key=lambda step: step[0])
+
+    def usage(self) -> Dict[str, int]:
+        usage = {}
+        for name, size in self._components.items():
+            try:
+                usage[name] = int(size())
+            except Exception as e:
+                logger.warning(f"No s'ha pogut mesurar {name}: {str(e)}")
+                usage[name] = 0
+        return usage
+
+    def maybe_check(self) -> List[str]:
+        """check() com a molt cada check_interval segons, i mai en dos fils alhora"""
+        if self._clock() - self._last_check < self.check_interval:
+            return []
+        if not self._check_lock.acquire(blocking=False):
+            return []
+        try:
+            self._last_check = self._clock()
+            return self.check()
+        finally:
+            self._check_lock.release()
+
+    def check(self) -> List[str]:
+        """Aplica els passos d'alliberament fins a quedar dins del pressupost"""
+        if not self.budget_bytes:
+            return []
+        usage = self.usage()
+        total = sum(usage.values())
+        if total <= self.budget_bytes:
+            return []
+
+        logger.warning(
+            f"🧠 Memòria per sobre del pressupost: {total / 1048576:.1f}MB > "
+            f"{self.budget_bytes / 1048576:.1f}MB, alliberant"
+        )
+        applied = []
+        for _, label, component, shed in self._steps:
+            if total <= self.budget_bytes:
+                break
+            before = usage.get(component, 0)
+            if not before:
+                continue
+            try:
+                shed()
+                usage[component] = int(self._components[component]())
+            except Exception as e:
+                logger.warning(f"Error alliberant {label}: {str(e)}")
+                continue
+
+            freed = before - usage[component]
+            total -= freed
+            applied.append(label)
+            logger.info(f"🧹 {label}: {freed / 1024:.0f}KB alliberats")
+            if self.store:
+                self.store.incr(f"memory:{label}:count")
+                self.store.incr(f"memory:{label}:freed_bytes", max(freed, 0))
+        return applied
+
+    def get_shed_counters(self) -> Dict[str, Dict[str, int]]:
+        report = {}
+        if not self.store:
+            return report
+        for name, value in self.store.get_counters('memory:').items():
+            _, label, metric = name.split(':')
+            report.setdefault(label, {})[metric] = value
+        return report
+
+    def report(self, tracemalloc_top: int = 0) -> Dict:
+        usage = self.usage()
+        report = {
+            'budget': self.budget_bytes,
+            'total': sum(usage.values()),
+            'rss': process_rss(),
+            'components': usage,
+            'shed': self.get_shed_counters(),
+        }
+        if tracemalloc_top:
+            report['tracemalloc'] = tracemalloc_snapshot(tracemalloc_top)
+        return report
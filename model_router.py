@@ -0,0 +1,440 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Política de models per nivells (tiers) per a les crides a Gemini:
+petició de cobertura (hedging) quan una crida supera el percentil de latència,
+canvi de model quan s'exhaureix la quota i circuit breaker per model.
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional
+
+import deadlines
+from deadlines import DeadlineExceeded
+from tracing import span, wrap_context
+
+logger = logging.getLogger(__name__)
+
+# Paraules clau que identifiquen un error de quota o límit de peticions
+QUOTA_KEYWORDS = ["429", "resource exhausted", "quota", "rate limit"]
+
+DEFAULT_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Indica si l'error correspon a un 429 o quota exhaurida"""
+    error_str = str(error).lower()
+    return any(keyword in error_str for keyword in QUOTA_KEYWORDS)
+
+
+class AllTiersFailedError(Exception):
+    """Cap nivell de model ha pogut respondre"""
+
+
+class GeneratedText(str):
+    """Text generat amb el nombre de tokens de sortida (si l'API el retorna)"""
+
+    output_tokens = None
+
+
+def output_tokens(text: str) -> int:
+    """Tokens de sortida reals, o una estimació (~4 caràcters per token)"""
+    tokens = getattr(text, 'output_tokens', None)
+    return tokens if tokens is not None else max(1, len(text) // 4)
+
+
+class GeminiClient:
+    """Client real de Gemini; manté un GenerativeModel per nom de model"""
+
+    def __init__(self, generation_config: Dict, safety_settings: Optional[List[Dict]] = None):
+        import google.generativeai as genai
+
+        self._genai = genai
+        self.generation_config = generation_config
+        self.safety_settings = safety_settings or DEFAULT_SAFETY_SETTINGS
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _get_model(self, model_name: str):
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = self._genai.GenerativeModel(
+                    model_name,
+                    generation_config=self.generation_config,
+                    safety_settings=self.safety_settings
+                )
+            return self._models[model_name]
+
+    def generate(self, model_name: str, contents: List[Dict], generation_config: Optional[Dict] = None,
+                 timeout: Optional[float] = None) -> str:
+        """Genera una resposta a partir de l'historial complet"""
+        response = self._get_model(model_name).generate_content(
+            contents,
+            generation_config=generation_config,
+            request_options={'timeout': timeout} if timeout else None
+        )
+        text = GeneratedText(response.text)
+        usage = getattr(response, 'usage_metadata', None)
+        text.output_tokens = getattr(usage, 'candidates_token_count', None) if usage else None
+        return text
+
+
+class CircuitBreaker:
+    """Circuit breaker simple: closed -> open -> half_open -> closed"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._half_open_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self) -> bool:
+        """En half_open només deixa passar una petició de prova"""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._half_open_in_flight:
+                self._half_open_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._half_open_in_flight = False
+
+    def release(self):
+        """Allibera la petició de prova sense comptar-la com a èxit ni error"""
+        with self._lock:
+            self._half_open_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._half_open_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+
+
+class ModelTier:
+    """Un nivell de model amb les seves estadístiques de latència i hedging"""
+
+    def __init__(self, model_name: str, hedge_percentile: float = 95.0,
+                 failure_threshold: int = 3, reset_timeout: float = 60.0,
+                 window: int = 200, latency_max_age: float = 300.0, clock=time.monotonic):
+        self.model_name = model_name
+        self.hedge_percentile = hedge_percentile
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        # (instant, segons): les mostres caduquen perquè el mode degradat deixa de cridar
+        # el model i, sense caducitat, una latència alta antiga no es renovaria mai
+        self.latencies = deque(maxlen=window)
+        self.latency_max_age = latency_max_age
+        self._clock = clock
+        self.stats = {
+            'requests': 0,
+            'successes': 0,
+            'failures': 0,
+            'quota_errors': 0,
+            'skipped_open': 0,
+            'hedges_sent': 0,
+            'primary_wins': 0,
+            'hedge_wins': 0,
+            'deadline_exceeded': 0,
+        }
+        self._lock = threading.Lock()
+
+    def record(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self.latencies.append((self._clock(), seconds))
+
+    def _recent(self) -> List[float]:
+        """Latències dels últims latency_max_age segons (descarta les més antigues)"""
+        oldest = self._clock() - self.latency_max_age
+        with self._lock:
+            while self.latencies and self.latencies[0][0] < oldest:
+                self.latencies.popleft()
+            return [seconds for _, seconds in self.latencies]
+
+    def sample_count(self) -> int:
+        return len(self._recent())
+
+    def percentile(self, pct: float) -> Optional[float]:
+        samples = sorted(self._recent())
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def get_stats(self) -> Dict:
+        samples = self.sample_count()
+        with self._lock:
+            stats = dict(self.stats)
+        wins = stats['primary_wins'] + stats['hedge_wins']
+        stats.update({
+            'model': self.model_name,
+            'circuit': self.breaker.state,
+            'latency_samples': samples,
+            'latency_p50': self.percentile(50),
+            'latency_p95': self.percentile(95),
+            'hedge_win_rate': round(stats['hedge_wins'] / wins, 3) if wins else 0.0,
+        })
+        return stats
+
+
+class ModelRouter:
+    """Envia cada petició pel primer nivell disponible, amb hedging i fallback"""
+
+    def __init__(self, client, tiers: List[ModelTier], hedge_min_samples: int = 20,
+                 hedge_default_delay: Optional[float] = None, max_workers: int = 8):
+        if not tiers:
+            raise ValueError("Cal com a mínim un nivell de model")
+        self.client = client
+        self.tiers = tiers
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_default_delay = hedge_default_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+
+    @classmethod
+    def from_env(cls, client) -> "ModelRouter":
+        """Construeix la política a partir de les variables d'entorn
+
+        GEMINI_MODEL_TIERS: models separats per comes, en ordre de preferència
+        GEMINI_HEDGE_PERCENTILE: percentil de latència a partir del qual s'envia la còpia
+        GEMINI_HEDGE_DEFAULT_DELAY: segons d'espera abans de tenir prou mostres (buit = sense hedging)
+        GEMINI_BREAKER_FAILURES / GEMINI_BREAKER_RESET: paràmetres del circuit breaker
+        GEMINI_LATENCY_MAX_AGE: segons que es conserva cada mostra de latència
+        """
+        names = os.environ.get("GEMINI_MODEL_TIERS", "gemini-2.5-flash-lite,gemini-2.0-flash")
+        percentile = float(os.environ.get("GEMINI_HEDGE_PERCENTILE", 95))
+        failures = int(os.environ.get("GEMINI_BREAKER_FAILURES", 3))
+        reset = float(os.environ.get("GEMINI_BREAKER_RESET", 60))
+        default_delay = os.environ.get("GEMINI_HEDGE_DEFAULT_DELAY")
+        max_age = float(os.environ.get("GEMINI_LATENCY_MAX_AGE", 300))
+
+        tiers = [
+            ModelTier(name.strip(), hedge_percentile=percentile,
+                      failure_threshold=failures, reset_timeout=reset, latency_max_age=max_age)
+            for name in names.split(",") if name.strip()
+        ]
+        return cls(
+            client,
+            tiers,
+            hedge_default_delay=float(default_delay) if default_delay else None
+        )
+
+    def _hedge_delay(self, tier: ModelTier) -> Optional[float]:
+        if tier.sample_count() < self.hedge_min_samples:
+            return self.hedge_default_delay
+        return tier.percentile(tier.hedge_percentile)
+
+    def _timed_call(self, tier: ModelTier, contents: List[Dict], generation_config: Optional[Dict] = None,
+                    hedge: bool = False) -> str:
+        with span("gemini.generate", model=tier.model_name, hedge=hedge):
+            kwargs = {}
+            if generation_config:
+                kwargs['generation_config'] = generation_config
+            # La crida només disposa del temps que queda a la petició
+            timeout = deadlines.bounded_timeout('gemini', None)
+            if timeout is not None:
+                kwargs['timeout'] = timeout
+            start = time.monotonic()
+            result = self.client.generate(tier.model_name, contents, **kwargs)
+            tier.record_latency(time.monotonic() - start)
+            return result
+
+    def _call_hedged(self, tier: ModelTier, contents: List[Dict], generation_config: Optional[Dict] = None) -> str:
+        """Crida el model i, si tarda més del llindar, llança una segona petició"""
+        primary = self._executor.submit(wrap_context(self._timed_call), tier, contents, generation_config)
+        delay = self._hedge_delay(tier)
+        left = deadlines.remaining()
+
+        # Sense temps per a una petició de cobertura, només s'espera la principal
+        if delay is None or (left is not None and left <= delay):
+            done, _ = wait([primary], timeout=left)
+            if not done:
+                deadlines.record_overrun('gemini')
+                raise DeadlineExceeded('gemini')
+            result = primary.result()
+            tier.record('primary_wins')
+            return result
+
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            result = primary.result()
+            tier.record('primary_wins')
+            return result
+
+        logger.info(f"⏱️ {tier.model_name}: resposta lenta (>{delay:.2f}s), enviant petició de cobertura")
+        tier.record('hedges_sent')
+        hedge = self._executor.submit(wrap_context(self._timed_call), tier, contents, generation_config, True)
+        pending = {primary, hedge}
+        last_error = None
+
+        while pending:
+            done, pending = wait(pending, timeout=deadlines.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                deadlines.record_overrun('gemini')
+                raise DeadlineExceeded('gemini')
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                tier.record('primary_wins' if future is primary else 'hedge_wins')
+                return result
+
+        raise last_error
+
+    def generate(self, contents: List[Dict], generation_config: Optional[Dict] = None) -> str:
+        """Recorre els nivells fins que un respon; rellança l'últim error si tots fallen"""
+        last_error = None
+
+        for tier in self.tiers:
+            deadlines.check('gemini')
+            if not tier.breaker.allow_request():
+                tier.record('skipped_open')
+                continue
+
+            tier.record('requests')
+            try:
+                result = self._call_hedged(tier, contents, generation_config)
+            except DeadlineExceeded:
+                # Esgotar el termini de la petició no és culpa del model
+                tier.record('deadline_exceeded')
+                tier.breaker.release()
+                raise
+            except Exception as e:
+                if deadlines.caused_by_deadline(e):
+                    # El timeout de l'SDK és el temps restant de la petició: tampoc compta com a error
+                    tier.record('deadline_exceeded')
+                    tier.breaker.release()
+                    deadlines.record_overrun('gemini')
+                    raise DeadlineExceeded('gemini') from e
+                last_error = e
+                tier.record('failures')
+                tier.breaker.record_failure()
+                if is_quota_error(e):
+                    tier.record('quota_errors')
+                    logger.warning(f"⚠️ {tier.model_name}: quota exhaurida, provant el següent nivell")
+                else:
+                    logger.warning(f"⚠️ {tier.model_name}: error ({e}), provant el següent nivell")
+                continue
+
+            tier.record('successes')
+            tier.breaker.record_success()
+            return result
+
+        if last_error is None:
+            last_error = AllTiersFailedError("429 Tots els models tenen el circuit obert")
+        raise last_error
+
+    def is_degraded(self, latency_threshold: Optional[float] = None) -> bool:
+        """Cert si tots els circuits són oberts o el primer nivell disponible és massa lent
+
+        La lentitud es mesura només amb mostres recents: quan caduquen, es torna a cridar
+        el model i, si s'ha recuperat, se surt del mode degradat.
+        """
+        available = [tier for tier in self.tiers if tier.breaker.state != CircuitBreaker.OPEN]
+        if not available:
+            return True
+        if latency_threshold and available[0].sample_count() >= self.hedge_min_samples:
+            return available[0].percentile(50) > latency_threshold
+        return False
+
+    def get_stats(self) -> List[Dict]:
+        """Estadístiques per nivell: latència, hedging i estat del circuit"""
+        return [tier.get_stats() for tier in self.tiers]
+
+
+class RouterChat:
+    """Conversa amb historial propi que envia cada torn a través del ModelRouter
+
+    El preàmbul (prompt de sistema amb el corpus) es genera a cada crida a partir
+    d'un callable, de manera que l'historial no en guarda cap còpia.
+    Amb un store i un session_id, l'historial de cada usuari es llegeix i es desa
+    a l'estat compartit entre workers; sense, es fa servir l'historial local.
+    """
+
+    def __init__(self, router: ModelRouter, history: List[Dict], preamble=None,
+                 store=None, max_turns: int = 20):
+        self.router = router
+        self.history = list(history)
+        self.preamble = preamble
+        self.store = store
+        self.max_turns = max_turns
+        self._lock = threading.Lock()
+
+    def get_history(self, session_id: Optional[str] = None) -> List[Dict]:
+        if self.store and session_id:
+            return self.store.get_session(session_id) or []
+        with self._lock:
+            return list(self.history)
+
+    def append(self, session_id: Optional[str], message: str, text: str):
+        """Afegeix un torn pregunta/resposta, conservant només els últims max_turns"""
+        turns = [{"role": "user", "parts": [message]}, {"role": "model", "parts": [text]}]
+        if self.store and session_id:
+            # Atòmic al store: dues peticions del mateix usuari no es sobreescriuen els torns
+            self.store.append_session(session_id, turns, 2 * self.max_turns)
+            return
+        with self._lock:
+            self.history.extend(turns)
+            del self.history[:-2 * self.max_turns]
+
+    def compact(self, max_messages: int) -> int:
+        """Retalla l'historial local als últims max_messages missatges; retorna els eliminats"""
+        with self._lock:
+            removed = max(0, len(self.history) - max_messages)
+            del self.history[:removed]
+            return removed
+
+    def send_message(self, message: str, session_id: Optional[str] = None, remember: bool = True,
+                     generation_config: Optional[Dict] = None) -> str:
+        """Envia un torn; amb remember=False no es llegeix ni es desa cap historial"""
+        history = self.get_history(session_id) if remember else []
+        contents = history + [{"role": "user", "parts": [message]}]
+        if self.preamble:
+            contents = self.preamble() + contents
+
+        text = self.router.generate(contents, generation_config)
+
+        if remember:
+            self.append(session_id, message, text)
+        return text
@@ -0,0 +1,185 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Cache local (a disc, amb TTL) del document de descoberta OIDC i del JWKS
+de Google, i verificació local de l'ID token per evitar la crida a userinfo.
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_DISCOVERY_URL = 'https://accounts.google.com/.well-known/openid-configuration'
+
+
+def _max_age(response) -> Optional[float]:
+    """max-age de la capçalera Cache-Control, si n'hi ha"""
+    match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+    return float(match.group(1)) if match else None
+
+
+class OIDCCache:
+    """Document de descoberta i claus públiques del proveïdor, desats a disc"""
+
+    def __init__(self, discovery_url: str = GOOGLE_DISCOVERY_URL, cache_dir: str = os.path.join('state', 'oidc'),
+                 metadata_ttl: float = 86400, jwks_ttl: float = 3600, http=None):
+        self.discovery_url = discovery_url
+        self.cache_dir = cache_dir
+        self.metadata_ttl = metadata_ttl
+        self.jwks_ttl = jwks_ttl
+        self.http = http or requests
+        self._memory = {}  # nom -> (expira, dades)
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, f'{name}.json')
+
+    def _read_disk(self, name: str) -> Optional[Dict]:
+        try:
+            with open(self._path(name), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, name: str, entry: Dict):
+        # Escriptura atòmica perquè altres workers no llegeixin un fitxer a mitges
+        tmp_path = f"{self._path(name)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._path(name))
+
+    def _get(self, name: str, url: str, ttl: float, force: bool = False) -> Dict:
+        """Memòria -> disc -> xarxa; si la xarxa falla es fa servir la còpia caducada"""
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(name)
+            if cached and not force and cached[0] > now:
+                return cached[1]
+
+            entry = self._read_disk(name)
+            if entry and not force and entry['expires'] > now:
+                self._memory[name] = (entry['expires'], entry['data'])
+                return entry['data']
+
+            try:
+                response = self.http.get(url, timeout=10)
+                response.raise_for_status()
+                data = response.json()
+                expires = now + (_max_age(response) or ttl)
+                self._write_disk(name, {'expires': expires, 'data': data})
+                self._memory[name] = (expires, data)
+                logger.info(f"🔑 OIDC: {name} actualitzat des de {url}")
+                return data
+            except Exception as e:
+                if entry:
+                    logger.warning(f"OIDC: no s'ha pogut actualitzar {name} ({str(e)}), es fa servir la còpia desada")
+                    return entry['data']
+                raise
+
+    def nbytes(self) -> int:
+        """Bytes aproximats de la còpia en memòria (mida del JSON)"""
+        with self._lock:
+            return sum(len(json.dumps(data)) for _, data in self._memory.values())
+
+    def clear_memory(self):
+        """Descarta la còpia en memòria; la següent lectura es fa des del disc"""
+        with self._lock:
+            self._memory.clear()
+
+    def get_metadata(self, force: bool = False) -> Dict:
+        return self._get('metadata', self.discovery_url, self.metadata_ttl, force)
+
+    def get_jwks(self, force: bool = False) -> Dict:
+        return self._get('jwks', self.get_metadata()['jwks_uri'], self.jwks_ttl, force)
+
+    def authlib_metadata(self) -> Dict:
+        """Metadades en el format que espera authlib (sense descoberta per xarxa)"""
+        metadata = self.get_metadata()
+        return {
+            'authorize_url': metadata['authorization_endpoint'],
+            'access_token_url': metadata['token_endpoint'],
+            'issuer': metadata['issuer'],
+            'jwks_uri': metadata['jwks_uri'],
+            'userinfo_endpoint': metadata.get('userinfo_endpoint'),
+            'jwks': self.get_jwks(),
+        }
+
+    @staticmethod
+    def _token_kid(id_token: str) -> Optional[str]:
+        header = id_token.split('.')[0]
+        header += '=' * (-len(header) % 4)
+        return json.loads(base64.urlsafe_b64decode(header)).get('kid')
+
+    def verify_id_token(self, id_token: str, client_id: str, nonce: Optional[str] = None) -> Dict:
+        """Verifica signatura i claims de l'ID token amb les claus desades"""
+        from authlib.jose import JsonWebKey, jwt
+
+        jwks = self.get_jwks()
+        kid = self._token_kid(id_token)
+        if kid and kid not in {key.get('kid') for key in jwks.get('keys', [])}:
+            # Rotació de claus: el token és signat amb una clau que encara no tenim
+            logger.info(f"🔑 OIDC: clau {kid} desconeguda, refrescant JWKS")
+            jwks = self.get_jwks(force=True)
+
+        claims_options = {
+            'iss': {'essential': True, 'values': [self.get_metadata()['issuer']]},
+            'aud': {'essential': True, 'value': client_id},
+            'exp': {'essential': True},
+        }
+        if nonce:
+            claims_options['nonce'] = {'essential': True, 'value': nonce}
+
+        claims = jwt.decode(id_token, JsonWebKey.import_key_set(jwks), claims_options=claims_options)
+        claims.validate(leeway=60)
+        return dict(claims)
+
+
+class LoginTimer:
+    """Mesura la durada de cada pas del login i l'acumula a l'estat compartit"""
+
+    def __init__(self, store=None):
+        self.store = store
+        self.steps = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name] = (time.perf_counter() - start) * 1000
+
+    def finish(self) -> Dict[str, float]:
+        self.steps['total'] = (time.perf_counter() - self._start) * 1000
+        if self.store:
+            for name, ms in self.steps.items():
+                self.store.incr(f"login:{name}:count")
+                self.store.incr(f"login:{name}:ms", int(ms))
+        logger.info("⏱️ Login: " + ", ".join(f"{name}={ms:.0f}ms" for name, ms in self.steps.items()))
+        return self.steps
+
+
+def login_latency_report(store) -> Dict[str, Dict[str, float]]:
+    """Mitjana de cada pas del login a partir dels comptadors compartits"""
+    counters = store.get_counters('login:')
+    report = {}
+    for name, value in counters.items():
+        _, step, metric = name.split(':')
+        report.setdefault(step, {})[metric] = value
+    for step, values in report.items():
+        count = values.get('count', 0)
+        values['avg_ms'] = round(values.get('ms', 0) / count, 1) if count else 0.0
+    return report
@@ -0,0 +1,332 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Estat compartit entre processos (workers): sessions de xat, caches de
+respostes i comptadors. El backend per defecte és SQLite en mode WAL,
+que funciona en local sense serveis externs.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+# Espai de noms de la cache de respostes: l'únic que es pot buidar per alliberar memòria
+# (les reserves dels formularis, form:*, no s'han de perdre)
+ANSWER_CACHE_PREFIX = 'answer:'
+
+
+def _like_prefix(prefix: str) -> str:
+    """Patró LIKE que coincideix amb les claus que comencen pel prefix literal"""
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+class MemoryStateStore:
+    """Backend en memòria del procés (un sol worker o proves)"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._cache = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            data = self._sessions.get(key)
+            return json.loads(data) if data else None
+
+    def save_session(self, key: str, history: List[Dict]):
+        with self._lock:
+            # Es reinsereix perquè el diccionari quedi ordenat de la més antiga a la més recent
+            self._sessions.pop(key, None)
+            self._sessions[key] = json.dumps(history, ensure_ascii=False)
+
+    def append_session(self, key: str, messages: List[Dict], max_messages: int = 0) -> List[Dict]:
+        """Afegeix missatges a una conversa de forma atòmica (conserva els últims max_messages)"""
+        with self._lock:
+            data = self._sessions.pop(key, None)
+            history = (json.loads(data) if data else []) + list(messages)
+            if max_messages:
+                history = history[-max_messages:]
+            self._sessions[key] = json.dumps(history, ensure_ascii=False)
+            return history
+
+    def delete_session(self, key: str):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def cache_get(self, key: str):
+        with self._lock:
+            entry = self._cache.get(key)
+            if not entry:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._cache[key]
+                return None
+            return json.loads(value)
+
+    def cache_set(self, key: str, value, ttl: float):
+        with self._lock:
+            self._cache[key] = (json.dumps(value, ensure_ascii=False), time.time() + ttl)
+
+    def cache_add(self, key: str, value, ttl: float) -> bool:
+        """Desa el valor només si la clau no existeix (o ha caducat); cert si s'ha desat"""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[1] >= time.time():
+                return False
+            self._cache[key] = (json.dumps(value, ensure_ascii=False), time.time() + ttl)
+            return True
+
+    def cache_delete(self, key: str):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def cache_clear(self, prefix: str = '') -> int:
+        """Elimina les entrades de la cache amb aquest prefix (totes si és buit)"""
+        with self._lock:
+            keys = [key for key in self._cache if key.startswith(prefix)]
+            for key in keys:
+                del self._cache[key]
+            return len(keys)
+
+    def session_sizes(self) -> Dict[str, int]:
+        """Bytes aproximats de cada conversa desada"""
+        with self._lock:
+            return {key: sys.getsizeof(data) for key, data in self._sessions.items()}
+
+    def cache_bytes(self, prefix: str = '') -> int:
+        with self._lock:
+            return sum(
+                sys.getsizeof(key) + sys.getsizeof(value)
+                for key, (value, _) in self._cache.items() if key.startswith(prefix)
+            )
+
+    def compact_sessions(self, max_messages: int) -> int:
+        """Conserva només els últims max_messages missatges de cada conversa"""
+        with self._lock:
+            compacted = 0
+            for key, data in self._sessions.items():
+                history = json.loads(data)
+                if len(history) > max_messages:
+                    self._sessions[key] = json.dumps(history[-max_messages:] if max_messages else [], ensure_ascii=False)
+                    compacted += 1
+            return compacted
+
+    def drop_oldest_sessions(self, fraction: float) -> int:
+        """Elimina la fracció de converses actualitzades fa més temps"""
+        with self._lock:
+            count = int(len(self._sessions) * fraction)
+            for key in list(self._sessions)[:count]:
+                del self._sessions[key]
+            return count
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+            return self._counters[name]
+
+    def get_counters(self, prefix: str = '') -> Dict[str, int]:
+        with self._lock:
+            return {k: v for k, v in self._counters.items() if k.startswith(prefix)}
+
+
+class SQLiteStateStore:
+    """Backend SQLite (WAL) compartit per tots els workers de la màquina"""
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """Una connexió per fil i procés; WAL permet lectures concurrents amb un escriptor"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # Les connexions heretades d'un fork no es poden reutilitzar
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get_session(self, key: str) -> Optional[List[Dict]]:
+        row = self._conn().execute("SELECT data FROM sessions WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_session(self, key: str, history: List[Dict]):
+        self._conn().execute(
+            "INSERT INTO sessions (key, data, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+            (key, json.dumps(history, ensure_ascii=False), time.time())
+        )
+
+    def append_session(self, key: str, messages: List[Dict], max_messages: int = 0) -> List[Dict]:
+        """Llegeix, afegeix i desa dins d'una transacció: dos workers no es trepitgen els torns"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM sessions WHERE key = ?", (key,)).fetchone()
+            history = (json.loads(row[0]) if row else []) + list(messages)
+            if max_messages:
+                history = history[-max_messages:]
+            conn.execute(
+                "INSERT INTO sessions (key, data, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                (key, json.dumps(history, ensure_ascii=False), time.time())
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return history
+
+    def delete_session(self, key: str):
+        self._conn().execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+    def cache_get(self, key: str):
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE key = ? AND expires >= ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def cache_set(self, key: str, value, ttl: float):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+            (key, json.dumps(value, ensure_ascii=False), now + ttl)
+        )
+        conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+
+    def cache_add(self, key: str, value, ttl: float) -> bool:
+        """Desa el valor només si la clau no existeix (o ha caducat); cert si s'ha desat"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires < ?", (key, now))
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl)
+            ).rowcount == 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return inserted
+
+    def cache_delete(self, key: str):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def cache_clear(self, prefix: str = '') -> int:
+        """Elimina les entrades de la cache amb aquest prefix (totes si és buit)"""
+        return self._conn().execute(
+            "DELETE FROM cache WHERE key LIKE ? ESCAPE '\\'", (_like_prefix(prefix),)
+        ).rowcount
+
+    # Les sessions i la cache són al disc: no ocupen memòria del procés
+    def session_sizes(self) -> Dict[str, int]:
+        return {}
+
+    def cache_bytes(self, prefix: str = '') -> int:
+        return 0
+
+    def compact_sessions(self, max_messages: int) -> int:
+        conn = self._conn()
+        compacted = 0
+        for key, data in conn.execute("SELECT key, data FROM sessions").fetchall():
+            history = json.loads(data)
+            if len(history) > max_messages:
+                conn.execute(
+                    "UPDATE sessions SET data = ? WHERE key = ?",
+                    (json.dumps(history[-max_messages:] if max_messages else [], ensure_ascii=False), key)
+                )
+                compacted += 1
+        return compacted
+
+    def drop_oldest_sessions(self, fraction: float) -> int:
+        conn = self._conn()
+        total = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return conn.execute(
+            "DELETE FROM sessions WHERE key IN (SELECT key FROM sessions ORDER BY updated LIMIT ?)",
+            (int(total * fraction),)
+        ).rowcount
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, amount)
+            )
+            value = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def get_counters(self, prefix: str = '') -> Dict[str, int]:
+        rows = self._conn().execute(
+            "SELECT name, value FROM counters WHERE name LIKE ? ESCAPE '\\'", (_like_prefix(prefix),)
+        ).fetchall()
+        return dict(rows)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """Backend configurat amb STATE_BACKEND (sqlite | memory) i STATE_DB_PATH"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = os.environ.get('STATE_BACKEND', 'sqlite').lower()
+            if backend == 'memory':
+                _store = MemoryStateStore()
+            else:
+                path = os.environ.get('STATE_DB_PATH', os.path.join('state', 'riquer.sqlite3'))
+                try:
+                    _store = SQLiteStateStore(path)
+                    logger.info(f"🗄️ Estat compartit a {path} (SQLite WAL)")
+                except Exception as e:
+                    logger.error(f"Error obrint {path}, es fa servir l'estat en memòria: {str(e)}")
+                    _store = MemoryStateStore()
+        return _store
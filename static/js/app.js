@@ -1,8 +1,13 @@
 // Variables globales
 let chatMessages = [];
 let teachersList = [];
+let teacherEmailDomain = 'inscalaf.cat';
 let lastRequestTime = 0;
 const MIN_REQUEST_INTERVAL = 2000; // 2 segons entre peticions
+const REQUEST_BUDGET_MS = 25000; // Temps màxim d'espera d'una resposta del servidor
+const QA_DB_NAME = 'riquer-qa';
+const QA_CACHE_MAX = 50; // Màxim de parelles pregunta/resposta desades
+const QA_CACHE_TTL = 24 * 60 * 60 * 1000; // 24 hores
 
 // Elementos del DOM
 const chatForm = document.getElementById('chat-form');
@@ -24,6 +29,7 @@ async function loadTeachersList() {
         
         if (data.status === 'success') {
             teachersList = data.teachers;
+            teacherEmailDomain = data.email_domain || teacherEmailDomain;
             console.log('Llista de professors carregada:', teachersList.length, 'professors');
         } else {
             console.error('Error carregant professors:', data.error);
@@ -33,6 +39,93 @@ async function loadTeachersList() {
     }
 }
 
+// Normalitza una pregunta (igual que normalize_question al servidor)
+function normalizeQuestion(text) {
+    return text.toLowerCase()
+        .normalize('NFD').replace(/[\u0300-\u036f]/g, '')
+        .replace(/[^\w\s]/g, ' ')
+        .replace(/\s+/g, ' ')
+        .trim();
+}
+
+// Obre (o crea) la base de dades IndexedDB de respostes recents
+function openQaDb() {
+    return new Promise((resolve, reject) => {
+        if (!window.indexedDB) {
+            reject(new Error('IndexedDB no disponible'));
+            return;
+        }
+        const request = indexedDB.open(QA_DB_NAME, 1);
+        request.onupgradeneeded = () => {
+            const store = request.result.createObjectStore('answers', { keyPath: 'key' });
+            store.createIndex('updated', 'updated');
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function qaKey(message) {
+    return `${userData.contacte}|${normalizeQuestion(message)}`;
+}
+
+// Retorna la resposta desada per a una pregunta, o null
+async function getCachedAnswer(message) {
+    try {
+        const db = await openQaDb();
+        const entry = await new Promise((resolve, reject) => {
+            const request = db.transaction('answers').objectStore('answers').get(qaKey(message));
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+        if (entry && Date.now() - entry.updated < QA_CACHE_TTL) {
+            return entry.answer;
+        }
+    } catch (error) {
+        console.warn('Cache de respostes no disponible:', error);
+    }
+    return null;
+}
+
+// Desa una resposta i elimina les més antigues si se supera QA_CACHE_MAX
+async function storeAnswer(message, answer) {
+    try {
+        const db = await openQaDb();
+        const tx = db.transaction('answers', 'readwrite');
+        const store = tx.objectStore('answers');
+        store.put({ key: qaKey(message), answer, updated: Date.now() });
+
+        const countRequest = store.count();
+        countRequest.onsuccess = () => {
+            let excess = countRequest.result - QA_CACHE_MAX;
+            if (excess <= 0) return;
+            store.index('updated').openCursor().onsuccess = (e) => {
+                const cursor = e.target.result;
+                if (cursor && excess > 0) {
+                    cursor.delete();
+                    excess--;
+                    cursor.continue();
+                }
+            };
+        };
+    } catch (error) {
+        console.warn('No s\'ha pogut desar la resposta:', error);
+    }
+}
+
+// Torna a demanar la resposta en segon pla i actualitza el missatge si ha canviat
+async function revalidateAnswer(message, messageDiv, cachedAnswer) {
+    try {
+        const response = await getBotResponse(message);
+        if (response !== cachedAnswer) {
+            messageDiv.querySelector('.message-content').innerHTML = formatMessage(response);
+        }
+        await storeAnswer(message, response);
+    } catch (error) {
+        console.warn('No s\'ha pogut revalidar la resposta:', error);
+    }
+}
+
 // Manejo del input de mensajes
 messageInput.addEventListener('input', () => {
     // Ajustar altura del textarea automáticamente
@@ -72,6 +165,14 @@ chatForm.addEventListener('submit', async (e) => {
         addMessage("Vols contactar amb un professor. Si us plau, omple aquest formulari:", 'bot');
         createTeacherContactForm();
     } else {
+        // Pregunta repetida: es mostra la resposta desada i es revalida en segon pla
+        const cachedAnswer = await getCachedAnswer(message);
+        if (cachedAnswer) {
+            const messageDiv = addMessage(cachedAnswer, 'bot');
+            revalidateAnswer(message, messageDiv, cachedAnswer);
+            return;
+        }
+        
         // Mostrar indicador de escritura y obtener respuesta normal
         showTypingIndicator();
         
@@ -79,9 +180,10 @@ chatForm.addEventListener('submit', async (e) => {
             const response = await getBotResponse(message);
             hideTypingIndicator();
             addMessage(response, 'bot');
+            storeAnswer(message, response);
         } catch (error) {
             hideTypingIndicator();
-            addMessage("Ho sento, hi ha hagut un error. Si us plau, torna-ho a intentar.", 'bot');
+            addMessage(error.userMessage || "Ho sento, hi ha hagut un error. Si us plau, torna-ho a intentar.", 'bot');
         }
     }
 });
@@ -143,6 +245,8 @@ function addMessage(text, sender, isForm = false) {
         sender,
         timestamp: new Date()
     });
+    
+    return messageDiv;
 }
 
 // Función para formatear mensajes
@@ -171,7 +275,15 @@ function hideTypingIndicator() {
 }
 
 // Función para obtener respuesta del bot (AMB RATE LIMITING)
-async function getBotResponse(message) {
+// Clau única per a un enviament de formulari (Idempotency-Key)
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now().toString(16)}-${Math.random().toString(16).slice(2, 14)}`;
+}
+
+async function getBotResponse(message, idempotencyKey = null) {
     // Esperar si l'última petició va ser fa menys de 2 segons
     const now = Date.now();
     const timeSinceLastRequest = now - lastRequestTime;
@@ -185,17 +297,32 @@ async function getBotResponse(message) {
     lastRequestTime = Date.now();
     
     try {
+        const headers = {
+            'Content-Type': 'application/json',
+            // Temps màxim que el client està disposat a esperar la resposta
+            'X-Request-Budget-Ms': String(REQUEST_BUDGET_MS)
+        };
+        if (idempotencyKey) {
+            headers['Idempotency-Key'] = idempotencyKey;
+        }
+        
         const response = await fetch('/api/chat', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers: headers,
             body: JSON.stringify({
                 message: message,
                 timestamp: new Date().toISOString()
             })
         });
         
+        if (response.status === 429 || response.status === 504) {
+            // Límit de peticions o termini esgotat al servidor: es mostra el missatge a l'usuari
+            const data = await response.json();
+            const error = new Error(response.status === 429 ? 'Límit de peticions' : 'Termini esgotat');
+            error.userMessage = data.message;
+            throw error;
+        }
+        
         if (!response.ok) {
             throw new Error('Error en la respuesta del servidor');
         }
@@ -297,6 +424,9 @@ function createAbsenceForm() {
    setTimeout(() => {
        const form = document.getElementById(formId);
        if (form) {
+           // La mateixa clau per als reintents d'un mateix contingut
+           let idempotencyKey = null;
+           let submittedMessage = null;
            form.addEventListener('submit', async (e) => {
                e.preventDefault();
                const formData = new FormData(e.target);
@@ -304,6 +434,10 @@ function createAbsenceForm() {
                
                // Construir mensaje para enviar
                const message = `Justificar falta - Alumne: ${data.alumne}, Curs: ${data.curs}, Data: ${data.data}, Motiu: ${data.motiu}`;
+               if (message !== submittedMessage) {
+                   idempotencyKey = newIdempotencyKey();
+                   submittedMessage = message;
+               }
                
                // Deshabilitar el formulario con animación
                e.target.style.opacity = '0.5';
@@ -315,7 +449,7 @@ function createAbsenceForm() {
                
                // Enviar al backend
                try {
-                   const response = await getBotResponse(message);
+                   const response = await getBotResponse(message, idempotencyKey);
                    addMessage(response, 'bot');
                    // Ocultar formulario después de enviar
                    e.target.style.display = 'none';
@@ -418,7 +552,7 @@ function createTeacherContactForm() {
                 const autoEmail = selectedName.toLowerCase()
                     .normalize("NFD").replace(/[\u0300-\u036f]/g, "") // Eliminar acentos
                     .replace(/\s+/g, '.')
-                    .replace(/[^a-z0-9.]/g, '') + '@inscalaf.cat';
+                    .replace(/[^a-z0-9.]/g, '') + '@' + teacherEmailDomain;
                 emailAddress.textContent = autoEmail;
                 emailPreview.style.display = 'block';
             } else {
@@ -427,6 +561,9 @@ function createTeacherContactForm() {
         });
         
         if (form) {
+            // La mateixa clau per als reintents d'un mateix contingut
+            let idempotencyKey = null;
+            let submittedMessage = null;
             form.addEventListener('submit', async (e) => {
                 e.preventDefault();
                 const formData = new FormData(e.target);
@@ -434,6 +571,10 @@ function createTeacherContactForm() {
                 
                 // Construir mensaje para enviar
                 const message = `Contactar professor ${data.professor} - Assumpte: ${data.assumpte}, Missatge: ${data.missatge}${data.disponibilitat ? ', Disponibilitat: ' + data.disponibilitat : ''}`;
+                if (message !== submittedMessage) {
+                    idempotencyKey = newIdempotencyKey();
+                    submittedMessage = message;
+                }
                 
                 // Deshabilitar el formulario con animación
                 e.target.style.opacity = '0.5';
@@ -445,7 +586,7 @@ function createTeacherContactForm() {
                 
                 // Enviar al backend
                 try {
-                    const response = await getBotResponse(message);
+                    const response = await getBotResponse(message, idempotencyKey);
                     addMessage(response, 'bot');
                     // Ocultar formulario después de enviar
                     e.target.style.display = 'none';
@@ -488,6 +629,13 @@ function showMeetingForm() {
 window.addEventListener('load', async () => {
     console.log('Chat carregat per a:', userData.nom);
     
+    // Registrar el service worker (app shell offline i cache de professors)
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/sw.js').catch(error => {
+            console.warn('No s\'ha pogut registrar el service worker:', error);
+        });
+    }
+    
     // Cargar lista de profesores
     await loadTeachersList();
     
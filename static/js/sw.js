@@ -0,0 +1,108 @@
+// Service worker del xat: precàrrega de l'app shell i cache de /api/teachers
+const CACHE_VERSION = 'riquer-v1';
+const SHELL_CACHE = `${CACHE_VERSION}-shell`;
+const API_CACHE = `${CACHE_VERSION}-api`;
+const QA_DB_NAME = 'riquer-qa';
+
+// Recursos estàtics que es precarreguen en instal·lar
+const SHELL_ASSETS = [
+    '/static/css/styles.css',
+    '/static/js/app.js',
+    '/static/images/riquer_logo.png'
+];
+
+const OFFLINE_HTML = `<!DOCTYPE html>
+<html lang="ca"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Sense connexió - Xat Riquer</title><link rel="stylesheet" href="/static/css/styles.css"></head>
+<body><div style="padding: 40px; text-align: center;">
+<h2>Sense connexió</h2><p>No s'ha pogut connectar amb el servidor. Torna-ho a provar quan tinguis connexió.</p>
+</div></body></html>`;
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE).then(cache =>
+            // Un recurs que falti (p. ex. el logo) no ha d'impedir la instal·lació
+            Promise.all(SHELL_ASSETS.map(url => cache.add(url).catch(() => null)))
+        ).then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys().then(keys => Promise.all(
+            keys.filter(key => !key.startsWith(CACHE_VERSION)).map(key => caches.delete(key))
+        )).then(() => self.clients.claim())
+    );
+});
+
+// Navegació: xarxa primer, i si no hi ha connexió, la pàgina desada o la pàgina offline
+async function handleNavigation(request) {
+    const cache = await caches.open(SHELL_CACHE);
+    try {
+        const response = await fetch(request);
+        if (response.ok && !response.redirected && new URL(request.url).pathname === '/') {
+            cache.put('/', response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await cache.match('/');
+        return cached || new Response(OFFLINE_HTML, { headers: { 'Content-Type': 'text/html; charset=utf-8' } });
+    }
+}
+
+// Estàtics: cache primer, actualitzant en segon pla
+async function staleWhileRevalidate(request, cacheName, event) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(request);
+    const network = fetch(request).then(response => {
+        if (response.ok && !response.redirected) {
+            cache.put(request, response.clone());
+        }
+        return response;
+    }).catch(() => null);
+
+    if (cached) {
+        event.waitUntil(network);
+        return cached;
+    }
+    const response = await network;
+    return response || new Response(JSON.stringify({ status: 'error', error: 'Sense connexió' }), {
+        status: 503,
+        headers: { 'Content-Type': 'application/json' }
+    });
+}
+
+// En tancar sessió s'esborren les dades de l'usuari (pàgina, professors i respostes)
+async function clearUserData() {
+    await caches.delete(API_CACHE);
+    const cache = await caches.open(SHELL_CACHE);
+    await cache.delete('/');
+    indexedDB.deleteDatabase(QA_DB_NAME);
+}
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    const url = new URL(request.url);
+
+    if (request.method !== 'GET' || url.origin !== self.location.origin) {
+        return;
+    }
+
+    if (url.pathname === '/logout') {
+        event.waitUntil(clearUserData());
+        return;
+    }
+
+    if (request.mode === 'navigate') {
+        if (url.pathname === '/') {
+            event.respondWith(handleNavigation(request));
+        }
+        return;
+    }
+
+    if (url.pathname === '/api/teachers') {
+        event.respondWith(staleWhileRevalidate(request, API_CACHE, event));
+    } else if (url.pathname.startsWith('/static/')) {
+        event.respondWith(staleWhileRevalidate(request, SHELL_CACHE, event));
+    }
+});
@@ -0,0 +1,290 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Registre d'instituts (tenants) servits des d'un sol procés.
+Cada institut té el seu corpus, prompt de sistema i directori de professors;
+el client de models, el router, el planificador i el pool HTTP es comparteixen.
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from model_router import ModelRouter
+from fair_share import FairShareScheduler
+from shared_state import get_state_store
+
+logger = logging.getLogger(__name__)
+
+# Marcador on s'injecta el contingut dels arxius dins del prompt de sistema
+CORPUS_PLACEHOLDER = "{arxius}"
+
+DEFAULT_SYSTEM_PROMPT = """Ets Riquer, assistent virtual de l'Institut Alexandre de Riquer de Calaf.
+
+            PERSONALITAT: Amable, proper, eficient. SEMPRE en CATALÀ.
+
+            FUNCIONS:
+            - Informar sobre l'institut (horaris, cursos, contactes)
+            - Ajudar a contactar professors → suggereix botó "Sol·licitar reunió"
+            - Justificar faltes → suggereix botó "Justificar falta"
+            - Resoldre dubtes acadèmics i administratius
+
+            CONTACTE:
+            📍 C. Sant Joan Bta. de la Salle 6-8, 08280 Calaf
+            📞 93 868 04 14
+            📧 a8043395@xtec.cat
+            📧 abdellahbaghalbachiri@gmail.com (consergeria)
+            🌐 inscalaf.cat
+
+            HORARIS:
+            🏫 Classes: 8:00-14:35h
+            🏢 Atenció: dilluns-divendres 8:00-14:00h
+            📋 Secretaria: dilluns-divendres 9:00-13:00h
+
+            CURSOS: ESO (1r-4t), Batxillerat (1r-2n), FP (GM i GS)
+
+            REGLES:
+            ✓ Respostes breus i clares
+            ✓ Només info verificada dels arxius
+            ✓ Si no saps algo → indica-ho clarament
+            ✓ Emojis moderats (màx 2 per resposta)
+            ✗ NO inventis informació
+            ✗ NO temes aliens a l'institut
+
+            INFORMACIÓ DELS ARXIUS DE L'INSTITUT:
+            {arxius}
+
+            Respon SEMPRE en CATALÀ. Sigues útil i directe."""
+
+# Configuració de l'institut original (Alexandre de Riquer, Calaf)
+DEFAULT_TENANT = {
+    'id': 'riquer',
+    'name': 'Institut Alexandre de Riquer',
+    'hosts': [],
+    'file_urls': [
+        "https://drive.google.com/uc?export=download&id=1bL1CnwVTpKS_01AKDV1i7Uu90pImQQe1",
+        "https://drive.google.com/uc?export=download&id=1kOjm0jHpF-LqtXYC7uUC1HJAV7DQPBsy",
+        "https://drive.google.com/uc?export=download&id=1iMfgjXLrn51EkYhCqMejJT7K5M5J5Ezy",
+        "https://drive.google.com/uc?export=download&id=1N7Xpt9JSr1JPoIaju-ekIRW4NGVgPxMU",
+        "https://drive.google.com/uc?export=download&id=1neJFgTH0GWO5HbL64V6Fro0r1SKw8mFw",
+    ],
+    'system_prompt': DEFAULT_SYSTEM_PROMPT,
+    'greeting': ("Entès! Sóc Riquer, l'assistent virtual de l'Institut Alexandre de Riquer. "
+                 "He processat tota la informació de l'institut. "
+                 "Puc ajudar-te amb qualsevol consulta sobre l'institut. "
+                 "En què et puc ajudar avui?"),
+    'teachers': [
+        {'name': 'Jordi Pipó', 'email': 'jordi.pipo@inscalaf.cat'},
+        {'name': 'Anna Bresolí', 'email': 'anna.bresoli@inscalaf.cat'},
+        {'name': 'Gerard Corominas', 'email': 'gerard.corominas@inscalaf.cat'},
+        {'name': 'Roger Codina', 'email': 'roger.codina@inscalaf.cat'}
+    ],
+    'email_domain': 'inscalaf.cat',
+    'sender': 'riquer@inscalaf.cat',
+    'absence_recipient': 'abdellahbaghalbachiri@gmail.com',
+    'phone': '93 868 04 14',
+}
+
+
+# Camps obligatoris de cada institut: cap es pren de l'institut per defecte
+REQUIRED_FIELDS = (
+    'id', 'name', 'file_urls', 'system_prompt', 'teachers',
+    'email_domain', 'sender', 'absence_recipient', 'phone',
+)
+
+
+class TenantConfig:
+    """Configuració d'un institut"""
+
+    def __init__(self, data: Dict):
+        missing = [field for field in REQUIRED_FIELDS if data.get(field) is None or data.get(field) == '']
+        if missing:
+            raise ValueError(f"Institut '{data.get('id', '?')}': falten camps obligatoris: {', '.join(missing)}")
+        if CORPUS_PLACEHOLDER not in data['system_prompt']:
+            raise ValueError(f"Institut '{data['id']}': el system_prompt no conté {CORPUS_PLACEHOLDER}")
+
+        self.id = data['id']
+        self.name = data['name']
+        self.hosts = [host.lower() for host in data.get('hosts', [])]
+        self.file_urls = list(data['file_urls'])
+        self.system_prompt = data['system_prompt']
+        self.greeting = data.get('greeting') or (
+            f"Entès! Sóc l'assistent virtual de l'{self.name}. En què et puc ajudar avui?"
+        )
+        self.teachers = list(data['teachers'])
+        self.email_domain = data['email_domain']
+        self.sender = data['sender']
+        self.absence_recipient = data['absence_recipient']
+        self.phone = data['phone']
+
+    @classmethod
+    def default(cls) -> "TenantConfig":
+        """L'institut original, l'únic amb valors per defecte"""
+        return cls(DEFAULT_TENANT)
+
+    def build_context(self, corpus: str) -> str:
+        """Prompt de sistema amb el contingut dels arxius injectat"""
+        return self.system_prompt.replace(CORPUS_PLACEHOLDER, corpus)
+
+
+class SharedResources:
+    """Recursos compartits per tots els instituts del procés"""
+
+    def __init__(self, client=None, pool_size: int = 10):
+        self.client = client
+        self.router = None
+        self._lock = threading.Lock()
+
+        # Repartiment just de les crides al model entre usuaris
+        self.scheduler = FairShareScheduler.from_env(store=get_state_store())
+
+        # Pool HTTP comú per a Drive i Mailgun
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+    def get_model_client(self, factory):
+        """Crea el client i el router la primera vegada i els reutilitza després"""
+        with self._lock:
+            if self.client is None:
+                self.client = factory()
+            if self.router is None:
+                self.router = ModelRouter.from_env(self.client)
+            return self.client, self.router
+
+
+class TenantRegistry:
+    """Carrega els bots per institut sota demanda i els descarta quan queden inactius"""
+
+    def __init__(self, configs: List[TenantConfig], shared: Optional[SharedResources] = None,
+                 idle_ttl: float = 1800, bot_factory=None, clock=time.monotonic):
+        if not configs:
+            raise ValueError("Cal com a mínim un institut configurat")
+        self.configs = {config.id: config for config in configs}
+        self.default_id = configs[0].id
+        self.shared = shared or SharedResources()
+        self.idle_ttl = idle_ttl
+        self._bot_factory = bot_factory
+        self._clock = clock
+        self._bots = {}
+        self._last_used = {}
+        self._load_locks = {tenant_id: threading.Lock() for tenant_id in self.configs}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, bot_factory=None) -> "TenantRegistry":
+        """TENANTS_CONFIG: ruta a un JSON amb una llista d'instituts (el primer és el per defecte)"""
+        path = os.environ.get('TENANTS_CONFIG')
+        configs = []
+
+        if path:
+            # Una configuració incompleta o mal formada atura l'arrencada (ValueError)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    items = json.load(f)
+            except OSError as e:
+                logger.error(f"Error llegint TENANTS_CONFIG ({path}): {str(e)}")
+            else:
+                configs = [TenantConfig(item) for item in items]
+                logger.info(f"🏫 {len(configs)} instituts carregats de {path}")
+
+        if not configs:
+            configs = [TenantConfig.default()]
+
+        return cls(
+            configs,
+            idle_ttl=float(os.environ.get('TENANT_IDLE_TTL', 1800)),
+            bot_factory=bot_factory
+        )
+
+    def resolve(self, host: str) -> str:
+        """Institut corresponent a un host (sense port); si no n'hi ha cap, el per defecte"""
+        host = (host or '').split(':')[0].lower()
+        for config in self.configs.values():
+            if host in config.hosts:
+                return config.id
+        return self.default_id
+
+    def get(self, tenant_id: Optional[str] = None):
+        """Retorna el bot de l'institut, creant-lo si no està carregat"""
+        tenant_id = tenant_id or self.default_id
+        if tenant_id not in self.configs:
+            raise KeyError(f"Institut desconegut: {tenant_id}")
+
+        self.evict_idle()
+
+        with self._load_locks[tenant_id]:
+            bot = self._bots.get(tenant_id)
+            if bot is None:
+                logger.info(f"🏫 Carregant institut '{tenant_id}'")
+                bot = self._create_bot(self.configs[tenant_id])
+                with self._lock:
+                    self._bots[tenant_id] = bot
+            with self._lock:
+                self._last_used[tenant_id] = self._clock()
+            return bot
+
+    def get_for_host(self, host: str):
+        return self.get(self.resolve(host))
+
+    def _create_bot(self, config: TenantConfig):
+        if self._bot_factory:
+            return self._bot_factory(config, self.shared)
+
+        from chat_backend import RiquerChatBot
+        return RiquerChatBot(tenant=config, shared=self.shared)
+
+    def evict_idle(self) -> List[str]:
+        """Descarta els instituts sense activitat durant més de idle_ttl segons"""
+        now = self._clock()
+        evicted = []
+        bots = []
+
+        with self._lock:
+            for tenant_id, last_used in list(self._last_used.items()):
+                if now - last_used > self.idle_ttl:
+                    bots.append(self._bots.pop(tenant_id, None))
+                    self._last_used.pop(tenant_id, None)
+                    evicted.append(tenant_id)
+
+        # Es tanca el corpus mapat (mapa i descriptor de fitxer) dels bots descarregats
+        for bot in bots:
+            close = getattr(bot, 'close', None)
+            if close:
+                try:
+                    close()
+                except Exception as e:
+                    logger.warning(f"Error tancant un institut descarregat: {str(e)}")
+
+        for tenant_id in evicted:
+            logger.info(f"💤 Institut '{tenant_id}' descarregat per inactivitat")
+        return evicted
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._bots)
+
+    def loaded_bots(self) -> List:
+        """Bots carregats, sense marcar-los com a utilitzats"""
+        with self._lock:
+            return list(self._bots.values())
+
+    def get_status(self) -> Dict:
+        with self._lock:
+            now = self._clock()
+            return {
+                'configured': list(self.configs),
+                'loaded': {
+                    tenant_id: round(now - last_used, 1)
+                    for tenant_id, last_used in self._last_used.items()
+                },
+                'idle_ttl': self.idle_ttl,
+            }
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# Els mòduls de l'aplicació són a l'arrel del repositori
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Comptadors d'excés de termini en memòria, sense crear state/ durant les proves
+os.environ.setdefault('STATE_BACKEND', 'memory')
+
+
+class FakeClock:
+    """Rellotge manual per als components que accepten clock=..."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
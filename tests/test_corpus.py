@@ -0,0 +1,81 @@
+import os
+
+from corpus import Corpus
+
+
+def test_rebuild_keeps_existing_map_readable(tmp_path):
+    path = str(tmp_path / 'riquer.corpus')
+    old = Corpus.build(path, [('A', 'contingut antic ' * 1000)])
+
+    # Un altre worker (o el bot recarregat) reconstrueix el mateix fitxer
+    new = Corpus.build(path, [('A', 'nou')])
+
+    assert old.full_text() == 'contingut antic ' * 1000
+    assert new.full_text() == 'nou'
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+    old.close()
+    new.close()
+
+
+def test_build_maps_documents(tmp_path):
+    corpus = Corpus.build(str(tmp_path / 'c.corpus'), [('A', 'hola'), ('B', 'adéu')])
+    assert corpus.labels() == ['A', 'B']
+    assert corpus.text(1) == 'adéu'
+    assert corpus.nbytes == len('holaadéu'.encode('utf-8'))
+    corpus.close()
+
+
+def test_close_with_open_view_does_not_raise(tmp_path):
+    corpus = Corpus.build(str(tmp_path / 'c.corpus'), [('A', 'text')])
+    view = corpus.view(0)
+    corpus.close()
+    assert bytes(view) == b'text'
+    assert corpus.full_text() == ''
+
+
+def test_concurrent_builds_keep_their_own_content(tmp_path, monkeypatch):
+    path = str(tmp_path / 'riquer.corpus')
+    real_replace = os.replace
+    others = []
+
+    def replace_then_overwrite(src, dst):
+        # Un altre worker escriu el mateix camí just després del nostre rename
+        real_replace(src, dst)
+        monkeypatch.setattr(os, 'replace', real_replace)
+        others.append(Corpus.build(path, [('X', 'contingut de l’altre worker ' * 10)]))
+
+    monkeypatch.setattr(os, 'replace', replace_then_overwrite)
+    corpus = Corpus.build(path, [('A', 'primer'), ('B', 'segon document')])
+
+    assert corpus.text(1) == 'segon document'
+    assert corpus.full_text() == 'primersegon document'
+    corpus.close()
+    others[0].close()
+
+
+def test_empty_corpus(tmp_path):
+    corpus = Corpus.build(str(tmp_path / 'c.corpus'), [])
+    assert corpus.full_text() == ''
+    corpus.close()
+
+
+def test_memory_report_is_an_estimate_from_nbytes(tmp_path):
+    from corpus import memory_report
+
+    corpus = Corpus.build(str(tmp_path / 'c.corpus'), [('A', 'x' * 1000)])
+    report = memory_report(corpus, [])
+    assert report['after']['corpus_mmap'] == 1000
+    assert 1000 <= report['before_estimate']['file_contents'] < 1100
+    assert report['total_before_estimate'] > report['total_after']
+    corpus.close()
+
+
+def test_digest_changes_with_content(tmp_path):
+    path = str(tmp_path / 'c.corpus')
+    first = Corpus.build(path, [('A', 'horari antic')])
+    same = Corpus.build(path, [('A', 'horari antic')])
+    updated = Corpus.build(path, [('A', 'horari nou')])
+    assert first.digest == same.digest
+    assert first.digest != updated.digest
+    for corpus in (first, same, updated):
+        corpus.close()
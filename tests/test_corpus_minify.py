@@ -0,0 +1,128 @@
+import csv
+import io
+
+from corpus_minify import CELL_SEPARATOR, minify_document
+
+
+def split_row(line):
+    """Separa una fila minimitzada respectant els separadors escapats"""
+    cells, current, escaped = [], [], False
+    for char in line:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == CELL_SEPARATOR:
+            cells.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    cells.append(''.join(current))
+    return cells
+
+
+def parse_output(text):
+    """(columnes plegades, capçalera, files) del text minimitzat"""
+    lines = text.split('\n')
+    folded = {}
+    while lines and CELL_SEPARATOR not in lines[0] and ': ' in lines[0]:
+        name, value = lines.pop(0).split(': ', 1)
+        folded[name] = value
+    header = split_row(lines[0]) if lines else []
+    rows = [dict(zip(header, split_row(line))) for line in lines[1:]]
+    return folded, header, rows
+
+
+def to_csv(rows, delimiter=','):
+    out = io.StringIO()
+    csv.writer(out, delimiter=delimiter, lineterminator='\r\n').writerows(rows)
+    return out.getvalue()
+
+
+def assert_rows_preserved(rows, text):
+    """Cada fila original (sense capçaleres repetides) hi és amb tots els seus valors"""
+    header = rows[0]
+    folded, kept, output = parse_output(text)
+    for row in rows[1:]:
+        if row == header:
+            continue
+        expected = {name: value for name, value in zip(header, row) if value}
+        matches = [
+            out for out in output
+            if all(folded.get(name, out.get(name)) == value for name, value in expected.items())
+        ]
+        assert matches, f"fila perduda: {row}"
+
+
+ROWS = [
+    ['Curs', 'Grup', 'Tutor', 'Aula', 'Observacions', 'Centre'],
+    ['1r ESO', 'A', 'Jordi Pipó', '101', '', 'Calaf'],
+    ['1r ESO', 'B', 'Anna Bresolí', '102', '', 'Calaf'],
+    ['2n ESO', 'A', 'Gerard Corominas', '201', '', 'Calaf'],
+    ['2n ESO', 'A', 'Gerard Corominas', '201', '', 'Calaf'],
+    ['Curs', 'Grup', 'Tutor', 'Aula', 'Observacions', 'Centre'],
+    ['Batxillerat', 'A', 'Roger Codina', '301', '', 'Calaf'],
+]
+
+
+def test_table_is_compacted_without_losing_rows():
+    text, report = minify_document(to_csv(ROWS).encode('utf-8'))
+    assert report['kind'] == 'table'
+    assert report['rows_deduped'] == 2
+    assert report['columns_dropped'] == 1
+    assert report['columns_folded'] == 1
+    assert 'Observacions' not in text
+    assert 'Centre: Calaf' in text
+    assert text.count('Gerard Corominas') == 1
+    assert report['tokens_after'] < report['tokens_before']
+    assert_rows_preserved(ROWS, text)
+
+
+def test_semicolon_cp1252_input():
+    rows = [
+        ['Data', 'Activitat', 'Lloc'],
+        ['12/11', 'Sortida a Montserrat', 'Montserrat'],
+        ['20/12', 'Festival de Nadal', 'Gimnàs'],
+        ['15/01', 'Xerrada d’orientació', 'Biblioteca'],
+    ]
+    text, report = minify_document(to_csv(rows, ';').encode('cp1252'))
+    assert report['kind'] == 'table'
+    assert 'Gimnàs' in text and 'Xerrada d’orientació' in text
+    assert_rows_preserved(rows, text)
+
+
+def test_bom_and_html_input():
+    rows = [
+        ['Professor', 'Correu', 'Departament'],
+        ['<b>Jordi Pipó</b>', 'jordi.pipo@inscalaf.cat', 'Ciències &amp; Tecnologia'],
+        ['Anna Bresolí', 'anna.bresoli@inscalaf.cat', 'Llengües'],
+        ['Roger Codina', 'roger.codina@inscalaf.cat', 'Matemàtiques'],
+    ]
+    text, report = minify_document(b'\xef\xbb\xbf' + to_csv(rows).encode('utf-8'))
+    assert report['kind'] == 'table'
+    assert '﻿' not in text and '<b>' not in text
+    clean = [[cell.replace('<b>', '').replace('</b>', '').replace('&amp;', '&') for cell in row] for row in rows]
+    assert_rows_preserved(clean, text)
+
+
+def test_separator_inside_cells_is_escaped():
+    rows = [
+        ['Matèria', 'Horari', 'Aula'],
+        ['Física', 'dl 8:00|dc 10:00', '101'],
+        ['Química', 'dt 9:00', 'Lab\\1'],
+        ['Biologia', 'dj 11:00|dv 12:00', '103'],
+    ]
+    text, report = minify_document(to_csv(rows).encode('utf-8'))
+    assert report['kind'] == 'table'
+    _, header, output = parse_output(text)
+    assert header == rows[0]
+    assert [list(row.values()) for row in output] == rows[1:]
+    assert_rows_preserved(rows, text)
+
+
+def test_plain_text_is_only_cleaned():
+    content = "Horaris   de secretaria\n\n\n\nDe dilluns a divendres\n".encode('utf-8')
+    text, report = minify_document(content)
+    assert report['kind'] == 'text'
+    assert text == "Horaris de secretaria\n\nDe dilluns a divendres"
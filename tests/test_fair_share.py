@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from fair_share import FairShareScheduler, FairShareTimeout
+from model_router import is_quota_error
+
+
+def test_queue_timeout_is_not_a_quota_error():
+    scheduler = FairShareScheduler(concurrency=1, max_wait=0.05)
+    entered = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with scheduler.slot('a@x.cat'):
+            entered.set()
+            release.wait(1)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    entered.wait(1)
+    try:
+        with pytest.raises(FairShareTimeout) as error:
+            with scheduler.slot('b@x.cat'):
+                pass
+    finally:
+        release.set()
+        holder.join()
+
+    assert not is_quota_error(error.value)
+
+
+def test_rate_limit_uses_staff_weight(clock):
+    scheduler = FairShareScheduler(rate_per_minute=60, burst=2, staff_weight=3,
+                                   staff_domains=['ins.cat'], clock=clock)
+    assert [scheduler.check_rate('alumne@gmail.com') for _ in range(3)][-1] is not None
+    assert all(scheduler.check_rate('profe@ins.cat') is None for _ in range(6))
+    assert scheduler.check_rate('profe@ins.cat') is not None
+
+
+def test_bucket_pruning_uses_each_users_own_weight(clock):
+    scheduler = FairShareScheduler(rate_per_minute=60, burst=5, staff_weight=3,
+                                   staff_domains=['ins.cat'], clock=clock)
+    # Molts buckets plens (descartables) i un de personal a mig recarregar
+    scheduler._buckets = {f'user{i}@gmail.com': (5.0, 0.0) for i in range(10001)}
+    scheduler._buckets['profe@ins.cat'] = (10.0, 0.0)  # Capacitat 15: encara no és ple
+
+    scheduler.check_rate('alumne@gmail.com')
+
+    assert 'profe@ins.cat' in scheduler._buckets
+    assert 'user0@gmail.com' not in scheduler._buckets
+    assert 'alumne@gmail.com' in scheduler._buckets
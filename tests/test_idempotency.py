@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from idempotency import FormDeduplicator
+from memory_budget import MemoryBudget
+from shared_state import ANSWER_CACHE_PREFIX, MemoryStateStore, SQLiteStateStore
+
+MESSAGE = "Justificar falta - Alumne: Joan, Curs: 1r ESO, Data: 2026-10-19, Motiu: Metge"
+
+
+def ok(result):
+    return result.startswith("✅")
+
+
+class Sender:
+    def __init__(self, result="✅ enviat", delay=0.0):
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.result
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    return MemoryStateStore() if request.param == 'memory' else SQLiteStateStore(str(tmp_path / 's.db'))
+
+
+def test_same_key_is_sent_once(store):
+    forms = FormDeduplicator(store)
+    send = Sender()
+    first = forms.submit('riquer', 'a@x.cat', 'absence', MESSAGE, 'clau-0001', send, ok)
+    second = forms.submit('riquer', 'a@x.cat', 'absence', MESSAGE, 'clau-0001', send, ok)
+    assert first == second == "✅ enviat"
+    assert send.calls == 1
+    assert forms.get_counters('riquer')['absence'] == {'sent': 1, 'suppressed': 1}
+
+
+def test_fingerprint_catches_new_key_with_same_fields(store):
+    forms = FormDeduplicator(store)
+    send = Sender()
+    forms.submit('riquer', 'a@x.cat', 'absence', MESSAGE, 'clau-0001', send, ok)
+    forms.submit('riquer', 'A@x.cat', 'absence', MESSAGE.replace('Metge', 'metge '), 'clau-0002', send, ok)
+    assert send.calls == 1
+
+
+def test_in_flight_duplicates_wait_for_original(store):
+    forms = FormDeduplicator(store, poll_interval=0.02)
+    send = Sender(delay=0.2)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            forms.submit('riquer', 'a@x.cat', 'absence', MESSAGE, 'clau-0001', send, ok)))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert send.calls == 1
+    assert results == ["✅ enviat"] * 3
+
+
+def test_failed_send_can_be_retried(store):
+    forms = FormDeduplicator(store)
+    failing = Sender(result="❌ error")
+    forms.submit('riquer', 'a@x.cat', 'absence', MESSAGE, 'clau-0001', failing, ok)
+    forms.submit('riquer', 'a@x.cat', 'absence', MESSAGE, 'clau-0001', failing, ok)
+    assert failing.calls == 2
+
+
+def test_memory_shedding_keeps_form_claims():
+    store = MemoryStateStore()
+    forms = FormDeduplicator(store)
+    send = Sender()
+    store.cache_set(f'{ANSWER_CACHE_PREFIX}riquer:horari', 'x' * 5000, 60)
+    forms.submit('riquer', 'a@x.cat', 'absence', MESSAGE, 'clau-0001', send, ok)
+
+    budget = MemoryBudget(budget_bytes=1, store=store)
+    budget.track('answer_cache', lambda: store.cache_bytes(ANSWER_CACHE_PREFIX))
+    budget.shed_with('answer_cache', 'answer_cache', lambda: store.cache_clear(ANSWER_CACHE_PREFIX), 0)
+    assert budget.check() == ['answer_cache']
+    assert store.cache_get(f'{ANSWER_CACHE_PREFIX}riquer:horari') is None
+
+    forms.submit('riquer', 'a@x.cat', 'absence', MESSAGE, 'clau-0001', send, ok)
+    assert send.calls == 1
+
+
+def test_cache_clear_prefix_only(store):
+    store.cache_set('answer:a', 1, 60)
+    store.cache_set('form:key:b', 2, 60)
+    assert store.cache_clear('answer:') == 1
+    assert store.cache_get('answer:a') is None
+    assert store.cache_get('form:key:b') == 2
@@ -0,0 +1,198 @@
+import threading
+import time
+
+import pytest
+
+from deadlines import DeadlineExceeded, deadline_scope
+from model_router import CircuitBreaker, ModelRouter, ModelTier
+
+
+class FakeClient:
+    """Client fals: cada model respon segons una llista de comportaments per crida"""
+
+    def __init__(self, behaviours):
+        self.behaviours = behaviours
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def generate(self, model_name, contents, generation_config=None, timeout=None):
+        with self._lock:
+            index = self.calls.get(model_name, 0)
+            self.calls[model_name] = index + 1
+        plan = self.behaviours[model_name]
+        delay, outcome = plan[min(index, len(plan) - 1)]
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def test_hedge_wins_when_primary_is_slow():
+    client = FakeClient({'a': [(0.5, 'lenta'), (0.0, 'ràpida')]})
+    tier = ModelTier('a')
+    router = ModelRouter(client, [tier], hedge_default_delay=0.05)
+
+    assert router.generate([{}]) == 'ràpida'
+    assert tier.stats['hedges_sent'] == 1
+    assert tier.stats['hedge_wins'] == 1
+    assert client.calls['a'] == 2
+
+
+def test_quota_error_falls_back_to_next_tier():
+    client = FakeClient({
+        'a': [(0.0, Exception("429 Resource exhausted"))],
+        'b': [(0.0, 'resposta b')],
+    })
+    first, second = ModelTier('a'), ModelTier('b')
+    router = ModelRouter(client, [first, second])
+
+    assert router.generate([{}]) == 'resposta b'
+    assert first.stats['quota_errors'] == 1
+    assert first.stats['failures'] == 1
+    assert second.stats['successes'] == 1
+
+
+def test_breaker_open_half_open_closed(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+    clock.now = 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()  # Només una petició de prova
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.record_failure()
+    clock.now = 5
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_open_tier_is_skipped():
+    client = FakeClient({
+        'a': [(0.0, Exception("error intern"))],
+        'b': [(0.0, 'b')],
+    })
+    first = ModelTier('a', failure_threshold=1)
+    router = ModelRouter(client, [first, ModelTier('b')])
+
+    router.generate([{}])
+    assert first.breaker.state == CircuitBreaker.OPEN
+    router.generate([{}])
+    assert first.stats['skipped_open'] == 1
+    assert client.calls['a'] == 1
+
+
+def test_deadline_exceeded_does_not_trip_breaker():
+    client = FakeClient({'a': [(0.5, 'massa tard')], 'b': [(0.0, 'b')]})
+    first = ModelTier('a', failure_threshold=1)
+    router = ModelRouter(client, [first, ModelTier('b')])
+
+    with deadline_scope(0.05):
+        with pytest.raises(DeadlineExceeded):
+            router.generate([{}])
+
+    assert first.breaker.state == CircuitBreaker.CLOSED
+    assert first.stats['failures'] == 0
+    assert first.stats['deadline_exceeded'] == 1
+    assert client.calls.get('b', 0) == 0
+
+
+def test_sdk_timeouts_within_deadline_do_not_open_breakers():
+    class TimeoutRespectingClient:
+        """Com l'SDK: si la crida supera el timeout, llança el seu propi error de timeout"""
+
+        def __init__(self):
+            self.calls = 0
+
+        def generate(self, model_name, contents, generation_config=None, timeout=None):
+            self.calls += 1
+            if timeout is not None and timeout < 0.2:
+                time.sleep(timeout / 2)
+                raise Exception("504 Deadline Exceeded")
+            return 'ok'
+
+    client = TimeoutRespectingClient()
+    tiers = [ModelTier('a', failure_threshold=3), ModelTier('b', failure_threshold=3)]
+    router = ModelRouter(client, tiers)
+
+    for _ in range(3):
+        with deadline_scope(0.05):
+            with pytest.raises(DeadlineExceeded):
+                router.generate([{}])
+
+    assert all(tier.breaker.state == CircuitBreaker.CLOSED for tier in tiers)
+    assert tiers[0].stats['deadline_exceeded'] == 3
+    assert tiers[1].stats['requests'] == 0  # No es passa al següent nivell
+    assert router.generate([{}]) == 'ok'
+
+
+def test_timeout_without_deadline_is_a_failure():
+    client = FakeClient({'a': [(0.0, TimeoutError("timed out"))], 'b': [(0.0, 'b')]})
+    first = ModelTier('a', failure_threshold=1)
+    router = ModelRouter(client, [first, ModelTier('b')])
+
+    assert router.generate([{}]) == 'b'
+    assert first.breaker.state == CircuitBreaker.OPEN
+
+
+def test_deadline_bounds_client_timeout():
+    seen = {}
+
+    class RecordingClient:
+        def generate(self, model_name, contents, generation_config=None, timeout=None):
+            seen['timeout'] = timeout
+            return 'ok'
+
+    router = ModelRouter(RecordingClient(), [ModelTier('a')])
+    with deadline_scope(2):
+        router.generate([{}])
+    assert 0 < seen['timeout'] <= 2
+
+    router.generate([{}])
+    assert seen['timeout'] is None
+
+
+def test_latency_degradation_expires_with_old_samples(clock):
+    tier = ModelTier('a', latency_max_age=60, clock=clock)
+    router = ModelRouter(FakeClient({'a': [(0.0, 'ok')]}), [tier], hedge_min_samples=5)
+    for _ in range(5):
+        tier.record_latency(20.0)
+
+    assert router.is_degraded(latency_threshold=10)
+    assert tier.get_stats()['latency_samples'] == 5
+
+    # En mode degradat no arriben mostres noves: les antigues caduquen i es torna al model
+    clock.now = 61
+    assert not router.is_degraded(latency_threshold=10)
+    assert tier.get_stats()['latency_p50'] is None
+
+
+def test_router_chat_appends_concurrent_turns_atomically():
+    from model_router import RouterChat
+    from shared_state import MemoryStateStore
+
+    store = MemoryStateStore()
+    chat = RouterChat(None, [], store=store, max_turns=100)
+    threads = [
+        threading.Thread(target=chat.append, args=('u', f'pregunta {i}', f'resposta {i}'))
+        for i in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(store.get_session('u')) == 40
@@ -0,0 +1,80 @@
+import multiprocessing
+
+import pytest
+
+from shared_state import MemoryStateStore, SQLiteStateStore
+
+PROCESSES = 4
+INCREMENTS = 200
+TURNS = 25
+
+
+def _worker(path, worker_id, results):
+    """Cada procés obre la seva pròpia connexió al mateix fitxer"""
+    store = SQLiteStateStore(path)
+    for _ in range(INCREMENTS):
+        store.incr('total')
+    for turn in range(TURNS):
+        store.append_session('compartida', [{'worker': worker_id, 'turn': turn}])
+    store.save_session(f'worker:{worker_id}', [{'role': 'user', 'parts': [f'hola {worker_id}']}])
+    results.put(('claimed', worker_id, store.cache_add('form:key:unica', {'worker': worker_id}, 60)))
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / 'state.sqlite3')
+
+
+def test_multi_process_consistency(store_path):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    SQLiteStateStore(store_path)  # Esquema creat abans d'arrencar els workers
+
+    processes = [context.Process(target=_worker, args=(store_path, i, results)) for i in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    claims = [results.get(timeout=5) for _ in range(PROCESSES)]
+    store = SQLiteStateStore(store_path)
+
+    # Cap increment perdut
+    assert store.get_counters('total') == {'total': PROCESSES * INCREMENTS}
+
+    # Cap torn perdut i l'ordre de cada worker es conserva
+    history = store.get_session('compartida')
+    assert len(history) == PROCESSES * TURNS
+    for worker_id in range(PROCESSES):
+        turns = [item['turn'] for item in history if item['worker'] == worker_id]
+        assert turns == list(range(TURNS))
+
+    # Les sessions desades per un procés es llegeixen des d'un altre
+    for worker_id in range(PROCESSES):
+        assert store.get_session(f'worker:{worker_id}') == [{'role': 'user', 'parts': [f'hola {worker_id}']}]
+
+    # cache_add: exactament un procés obté la reserva
+    winners = [worker_id for _, worker_id, claimed in claims if claimed]
+    assert len(winners) == 1
+    assert store.cache_get('form:key:unica') == {'worker': winners[0]}
+
+
+@pytest.mark.parametrize('factory', [MemoryStateStore, None], ids=['memory', 'sqlite'])
+def test_store_contract(factory, store_path):
+    store = factory() if factory else SQLiteStateStore(store_path)
+
+    assert store.get_session('s') is None
+    store.save_session('s', [{'role': 'user', 'parts': ['a']}])
+    assert store.append_session('s', [{'role': 'model', 'parts': ['b']}], 1) == [{'role': 'model', 'parts': ['b']}]
+
+    assert store.cache_add('k', 1, 60)
+    assert not store.cache_add('k', 2, 60)
+    assert store.cache_get('k') == 1
+    store.cache_delete('k')
+    assert store.cache_add('k', 3, 60)
+    assert store.cache_add('expirada', 1, -1)
+    assert store.cache_add('expirada', 2, 60)  # Una clau caducada es pot tornar a reservar
+
+    assert store.incr('c', 2) == 2
+    assert store.incr('c') == 3
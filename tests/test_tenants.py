@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+pytest.importorskip('requests')
+
+from tenants import DEFAULT_TENANT, REQUIRED_FIELDS, TenantConfig, TenantRegistry
+
+
+def complete_tenant(**overrides):
+    data = {
+        'id': 'altre',
+        'name': 'Institut X',
+        'file_urls': [],
+        'system_prompt': 'Prompt {arxius}',
+        'teachers': [],
+        'email_domain': 'insx.cat',
+        'sender': 'bot@insx.cat',
+        'absence_recipient': 'faltes@insx.cat',
+        'phone': '900 000 000',
+    }
+    data.update(overrides)
+    return data
+
+
+def test_default_tenant_uses_builtin_values():
+    config = TenantConfig.default()
+    assert config.id == DEFAULT_TENANT['id']
+    assert config.absence_recipient == DEFAULT_TENANT['absence_recipient']
+
+
+def test_other_tenant_does_not_inherit_defaults():
+    config = TenantConfig(complete_tenant())
+    assert config.absence_recipient == 'faltes@insx.cat'
+    assert config.email_domain == 'insx.cat'
+    assert config.teachers == []
+    assert 'Institut X' in config.greeting
+
+
+@pytest.mark.parametrize('field', REQUIRED_FIELDS)
+def test_missing_field_raises(field):
+    data = complete_tenant()
+    del data[field]
+    with pytest.raises(ValueError, match=field):
+        TenantConfig(data)
+
+
+def test_system_prompt_without_corpus_placeholder_raises():
+    with pytest.raises(ValueError, match='arxius'):
+        TenantConfig(complete_tenant(system_prompt='Ets un assistent sense arxius'))
+
+
+def test_from_env_rejects_incomplete_tenant(tmp_path, monkeypatch):
+    path = tmp_path / 'tenants.json'
+    path.write_text(json.dumps([{'id': 'other', 'name': 'Institut X', 'file_urls': []}]))
+    monkeypatch.setenv('TENANTS_CONFIG', str(path))
+    with pytest.raises(ValueError):
+        TenantRegistry.from_env()
+
+
+def test_evict_idle_closes_bot(clock):
+    class FakeBot:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    registry = TenantRegistry([TenantConfig.default()], shared=object(), idle_ttl=10,
+                              bot_factory=lambda config, shared: FakeBot(), clock=clock)
+    bot = registry.get(DEFAULT_TENANT['id'])
+    clock.now = 11
+    assert registry.evict_idle() == [DEFAULT_TENANT['id']]
+    assert bot.closed
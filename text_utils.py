@@ -0,0 +1,22 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Utilitats de normalització de text compartides (claus de cache, cerca).
+"""
+
+import re
+import unicodedata
+
+
+def fold_accents(text: str) -> str:
+    """Minúscules i sense diacrítics: 'Natàlia' -> 'natalia'"""
+    text = unicodedata.normalize('NFD', text.lower())
+    return ''.join(char for char in text if unicodedata.category(char) != 'Mn')
+
+
+def normalize_question(text: str) -> str:
+    """Forma canònica d'una pregunta: sense accents, puntuació ni espais repetits"""
+    text = fold_accents(text)
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
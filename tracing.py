@@ -0,0 +1,225 @@
+"""
+XAT-RIQUER - Sistema de Xat Intel·ligent
+Copyright © 2026 [Abdellah Baghal]. Tots els drets reservats.
+
+Traces per petició sense col·lector extern: spans niats amb contextvars,
+trace_id propagat als logs i exportació a un buffer circular en memòria
+(consultable des d'una ruta d'administració) i, opcionalment, a un fitxer JSONL.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """Una operació dins d'una traça"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, attributes: Dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self._start_perf = time.perf_counter()
+        self.duration_ms = None
+        self.status = 'ok'
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration_ms = round((time.perf_counter() - self._start_perf) * 1000, 2)
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class RingBufferExporter:
+    """Últims N spans en memòria"""
+
+    def __init__(self, maxlen: int = 2000):
+        self._spans = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self._spans.append(span.to_dict())
+
+    def nbytes(self) -> int:
+        """Bytes aproximats dels spans desats (mida del JSON)"""
+        with self._lock:
+            spans = list(self._spans)
+        return sum(len(json.dumps(span, ensure_ascii=False, default=str)) for span in spans)
+
+    def clear(self) -> int:
+        with self._lock:
+            removed = len(self._spans)
+            self._spans.clear()
+            return removed
+
+    def get_spans(self, trace_id: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            spans = list(self._spans)
+        if trace_id:
+            spans = [span for span in spans if span['trace_id'] == trace_id]
+        return spans
+
+    def get_traces(self, limit: int = 20) -> List[Dict]:
+        """Traces més recents, amb els seus spans ordenats per inici"""
+        traces = {}
+        for span in self.get_spans():
+            traces.setdefault(span['trace_id'], []).append(span)
+
+        result = []
+        for trace_id, spans in list(traces.items())[-limit:][::-1]:
+            spans.sort(key=lambda span: span['start'])
+            root = next((span for span in spans if span['parent_id'] is None), spans[0])
+            result.append({
+                'trace_id': trace_id,
+                'root': root['name'],
+                'duration_ms': root['duration_ms'],
+                'spans': spans,
+            })
+        return result
+
+
+class FileExporter:
+    """Afegeix cada span com una línia JSON a un fitxer"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+class Tracer:
+    def __init__(self, exporters: List):
+        self.exporters = exporters
+
+    def export(self, span: Span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.warning(f"Error exportant span {span.name}: {str(e)}")
+
+
+ring_buffer = RingBufferExporter(int(os.environ.get('TRACE_BUFFER_SIZE', 2000)))
+tracer = Tracer([ring_buffer] + ([FileExporter(os.environ['TRACE_FILE'])] if os.environ.get('TRACE_FILE') else []))
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def start_span(name: str, trace_id: Optional[str] = None, **attributes):
+    """Obre un span fill de l'actual (o l'arrel d'una traça nova); retorna (span, token)"""
+    parent = _current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else uuid.uuid4().hex
+    span = Span(name, trace_id, parent.span_id if parent and parent.trace_id == trace_id else None, attributes)
+    return span, _current_span.set(span)
+
+
+def end_span(span: Span, token, error: Optional[BaseException] = None):
+    if error is not None:
+        span.status = 'error'
+        span.error = f"{type(error).__name__}: {error}"
+    span.end()
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # El token pertany a un altre context (p. ex. teardown en un context copiat)
+        _current_span.set(None)
+    tracer.export(span)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Context manager per a un span niat dins de la traça actual"""
+    current, token = start_span(name, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        end_span(current, token, e)
+        raise
+    else:
+        end_span(current, token)
+
+
+def traced(name: str):
+    """Decorador: executa la funció dins d'un span"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def wrap_context(func):
+    """Propaga la traça actual a una funció que s'executarà en un altre fil"""
+    context = contextvars.copy_context()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return wrapper
+
+
+class TraceContextFilter(logging.Filter):
+    """Afegeix trace_id i span_id a cada registre de log"""
+
+    def filter(self, record):
+        current = _current_span.get()
+        record.trace_id = current.trace_id if current else '-'
+        record.span_id = current.span_id if current else '-'
+        return True
+
+
+def install_log_correlation(log_format: str = '%(levelname)s:%(name)s:[trace=%(trace_id)s] %(message)s'):
+    """Instal·la el filtre i el format amb trace_id a tots els handlers del logger arrel"""
+    root = logging.getLogger()
+    if not root.handlers:
+        logging.basicConfig(level=logging.INFO)
+    for handler in root.handlers:
+        if not any(isinstance(f, TraceContextFilter) for f in handler.filters):
+            handler.addFilter(TraceContextFilter())
+            handler.setFormatter(logging.Formatter(log_format))